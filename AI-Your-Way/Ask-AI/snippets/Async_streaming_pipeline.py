@@ -0,0 +1,142 @@
+# Demonstrates: Async streaming query pipeline with early KB_DIRECT answer.
+# The synchronous pipeline only returns after 8B augmentation (8-12s on CPU).
+# This version streams the KB answer the moment retrieval finishes, then sends
+# augmentation as a follow-up event that may replace it — time-to-first-answer
+# drops from LLM latency to retrieval latency (~100ms).
+# Part of ask_ai.py. Not standalone.
+
+DISCONNECT_POLL_INTERVAL = 0.25   # seconds between is_disconnected() checks
+
+
+class ClientDisconnected(Exception):
+    """Raised inside the stream when the client has gone away."""
+
+
+async def _await_unless_disconnected(task, is_disconnected):
+    """
+    Awaits task, polling is_disconnected() while it runs.
+    Raises ClientDisconnected as soon as the client is gone, so in-flight
+    work is cancelled within one poll interval rather than at completion.
+    """
+    if is_disconnected is None:
+        return await task
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await is_disconnected():
+            raise ClientDisconnected()
+
+
+async def stream_query_pipeline(query_text, active_kbs, rag_engines, rerankers, is_disconnected=None):
+    """
+    Async generator over the same eight stages as process_query_pipeline.
+
+    Events (each is the full structured response plus an "event" key):
+        "answer"  — KB_DIRECT answer and its confidence, right after Stage 4
+        "update"  — replaces the previous answer (validated augmentation,
+                    or web fallback when the KB had nothing)
+        "done"    — terminal event, carries the final answer; same answer,
+                    source_type and augmented flag as process_query_pipeline
+
+    Web fallback:
+        Only a query with no KB answer reaches Stage 6 — a KB_DIRECT answer
+        is never empty, and a rejected augmentation returns the KB text — so
+        online_fallback starts right after retrieval in that case and never
+        runs for a KB answer.
+
+    Cancellation:
+        Pass is_disconnected (an async callable, e.g. the ASGI request's) to
+        stop when the client leaves. Closing the generator has the same effect.
+        Either way pending tasks are cancelled in the finally block.
+
+    Blocking work (FAISS, encoders, Ollama) runs in worker threads via
+    asyncio.to_thread — including per-event confidence scoring, which
+    encodes the emitted answer for RAG consensus and would otherwise stall
+    every other connection on the loop. A cancelled augmentation stops
+    being awaited immediately; the underlying LLM HTTP call finishes in its
+    thread and its result is discarded.
+    """
+    emb_ctx = QueryEmbeddingContext(query_text)
+    pending = set()
+
+    def _respond(event, answer, source_type, augmented):
+        confidence, rag_score = score_answer(state, answer, source_type, rag_engines, emb_ctx)
+        response = build_response(query_text, state, answer, source_type, augmented, confidence, rag_score)
+        return {"event": event} | response
+
+    async def emit(event, answer, source_type, augmented):
+        task = asyncio.create_task(asyncio.to_thread(_respond, event, answer, source_type, augmented))
+        pending.add(task)
+        response = await _await_unless_disconnected(task, is_disconnected)
+        pending.discard(task)
+        return response
+
+    try:
+        # Stages 1-4 — retrieval only, no LLM
+        retrieval = asyncio.create_task(asyncio.to_thread(
+            run_retrieval_stages, query_text, active_kbs, rag_engines, rerankers, emb_ctx
+        ))
+        pending.add(retrieval)
+        state = await _await_unless_disconnected(retrieval, is_disconnected)
+        pending.discard(retrieval)
+
+        answer, source_type, augmented = state["answer"], state["source_type"], False
+
+        # Stage 6 can only be reached without a KB answer — start it now if so
+        web_task = None
+        if needs_web_fallback(answer):
+            web_task = asyncio.create_task(asyncio.to_thread(online_fallback, query_text, use_async=True))
+            pending.add(web_task)
+
+        augment_task = None
+        if should_augment(state):
+            augment_task = asyncio.create_task(asyncio.to_thread(
+                augment_answer_with_llm,
+                state["kb_answer"], query_text, state["reranked"], state["source_kb"],
+                rag_engines, emb_ctx=emb_ctx
+            ))
+            pending.add(augment_task)
+
+        # First answer — as soon as Stage 4 is done
+        if source_type == "KB_DIRECT":
+            yield await emit("answer", answer, source_type, False)
+
+        # Stage 5 follow-up — may replace the streamed answer
+        if augment_task is not None:
+            answer, augmented = await _await_unless_disconnected(augment_task, is_disconnected)
+            pending.discard(augment_task)
+            # Rejected: answer is now the unformatted kb_answer, as in the sync pipeline
+            if augmented:
+                source_type = "KB_AUGMENTED"
+                yield await emit("update", answer, source_type, True)
+
+        # Stage 6 — the request started above, or (defensively) start it now
+        if needs_web_fallback(answer):
+            if web_task is None:
+                web_task = asyncio.create_task(asyncio.to_thread(online_fallback, query_text, use_async=True))
+                pending.add(web_task)
+            web_result = await _await_unless_disconnected(web_task, is_disconnected)
+            pending.discard(web_task)
+            answer, source_type = resolve_web_fallback(web_result)
+            yield await emit("update", answer, source_type, False)
+
+        yield await emit("done", answer, source_type, augmented)
+
+    except ClientDisconnected:
+        return
+
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# In an ASGI /api/query/stream endpoint (server-sent events):
+#
+#   async def events():
+#       async for event in stream_query_pipeline(
+#           query, active_kbs, rag_engines, rerankers,
+#           is_disconnected=request.is_disconnected
+#       ):
+#           yield f"data: {json.dumps(event)}\n\n"
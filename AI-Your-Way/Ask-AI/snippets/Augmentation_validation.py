@@ -3,7 +3,7 @@
 # that drift from the original KB content using two independent checks.
 # Part of ask_ai.py answer pipeline. Not standalone.
 
-def augment_answer_with_llm(kb_answer, query, reranked, source_kb, rag_engines):
+def augment_answer_with_llm(kb_answer, query, reranked, source_kb, rag_engines, emb_ctx=None):
     """
     Refines a KB answer using the reasoning LLM, then validates the result.
 
@@ -20,6 +20,10 @@ def augment_answer_with_llm(kb_answer, query, reranked, source_kb, rag_engines):
 
     If either check fails, returns the original KB answer unchanged.
     Augmentation is never silently accepted.
+
+    Both answers are encoded in a single batched call. When the pipeline
+    passes its QueryEmbeddingContext, the vectors are memoized there and
+    Stage 7 consensus scoring reuses whichever one becomes the final answer.
     """
     if not REASONING_AGENT:
         return kb_answer, False
@@ -45,7 +49,9 @@ def augment_answer_with_llm(kb_answer, query, reranked, source_kb, rag_engines):
         }
     ]
 
-    augmented = REASONING_AGENT.chat(messages)
+    trace = emb_ctx.trace if emb_ctx is not None else NULL_TRACE
+    with trace.llm("reasoning"):
+        augmented = REASONING_AGENT.chat(messages)
 
     if not augmented or augmented in ["LLM_FAIL", "LLM_UNAVAILABLE"]:
         return kb_answer, False
@@ -63,9 +69,15 @@ def augment_answer_with_llm(kb_answer, query, reranked, source_kb, rag_engines):
     semantic = 0.0
     if source_kb in rag_engines:
         try:
-            embedder = rag_engines[source_kb].embedder
-            kb_emb = embedder.encode([kb_answer], normalize_embeddings=True)[0]
-            aug_emb = embedder.encode([augmented], normalize_embeddings=True)[0]
+            engine = rag_engines[source_kb]
+            if emb_ctx is not None:
+                kb_emb, aug_emb = emb_ctx.text_embeddings(
+                    embedding_key(engine), engine.embedder, [kb_answer, augmented]
+                )
+            else:
+                kb_emb, aug_emb = engine.embedder.encode(
+                    [kb_answer, augmented], normalize_embeddings=True
+                )
             semantic = cosine_similarity(kb_emb, aug_emb)
         except Exception:
             pass
@@ -0,0 +1,146 @@
+# Demonstrates: Batched query API for bulk evaluation runs.
+# Pushing thousands of questions through process_query_pipeline one at a time
+# pays one encoder call and one FAISS search per query per KB. This entry point
+# batches every stage that batches well and keeps per-query results identical
+# to the single-query structured response.
+# Part of ask_ai.py. Not standalone.
+
+QUERY_ENCODE_BATCH_SIZE = 64    # queries per encoder forward pass
+BATCH_AUGMENT_CONCURRENCY = 2   # 8B augmentations in flight — CPU-bound, keep low
+
+
+# --- RAGEngine methods ---
+
+def encode_queries(self, texts: list) -> np.ndarray:
+    """
+    Encodes many queries with the KB's model in large batches.
+    encode_query is the one-row case, so single and batched paths produce
+    the same vectors (up to float rounding from padding within a batch).
+    """
+    return self.embedder.encode(
+        texts,
+        batch_size=QUERY_ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+
+
+def encode_query(self, text: str) -> np.ndarray:
+    return self.encode_queries([text])[0]
+
+
+def topk_retrieve_batch(self, query_embs: np.ndarray, k: int) -> list:
+    """
+    One FAISS search for a whole query matrix. Returns one result list per row.
+
+    Hit vectors are reconstructed in one reconstruct_batch over the unique
+    ids across all rows, attached as r["embedding"] for reranking and
+    consensus scoring. Lossy indexes (PQ, or low-fidelity fp16 / sq8) get no
+    embedding — the reranker falls back to encoding those rows.
+    """
+    query_embs = np.ascontiguousarray(np.atleast_2d(query_embs), dtype=np.float32)
+    distances, ids = self.index.search(query_embs, k)
+
+    vectors = {}
+    if index_can_reconstruct(self.index, self.vector_storage, self.vector_fidelity):
+        unique_ids = np.unique(ids[ids >= 0])
+        if unique_ids.size:
+            vectors = dict(zip(unique_ids.tolist(), self.index.reconstruct_batch(unique_ids)))
+
+    batch_results = []
+    for row_distances, row_ids in zip(distances, ids):
+        results = []
+        for dist, idx in zip(row_distances, row_ids):
+            if idx < 0:   # fewer than k vectors in the index
+                continue
+            r = dict(self.meta[int(idx)])
+            r["faiss_id"] = int(idx)
+            r["distance"] = float(dist)
+            if int(idx) in vectors:
+                r["embedding"] = vectors[int(idx)]
+            results.append(r)
+        batch_results.append(results)
+
+    return batch_results
+
+
+def topk_retrieve(self, query_emb: np.ndarray, k: int) -> list:
+    return self.topk_retrieve_batch(query_emb, k)[0]
+
+
+# --- Batch entry point ---
+
+def process_query_batch(queries, active_kbs, rag_engines, rerankers,
+                        augment_concurrency=BATCH_AUGMENT_CONCURRENCY):
+    """
+    Runs many queries through the eight-stage pipeline with batched stages.
+
+    Stage 1a — one encode per embedding_key:
+        All queries encoded by the first KB using each (model, backend), in
+        QUERY_ENCODE_BATCH_SIZE batches, and seeded into each query's
+        QueryEmbeddingContext.
+    Stage 1b — one FAISS search per KB:
+        The full query matrix goes to index.search in one call.
+    Stage 2 — one vector pass per embedding_key:
+        Candidates for every query are gathered per key and resolved by
+        LocalReranker.candidate_vectors in one pass — one reconstruct_batch
+        per KB, one large encoder batch for anything left. Per-query
+        reranking then only does its mat-vec.
+    Stages 3-8 — per query, via rank_and_extract and finish_query, the
+        same code process_query_pipeline runs. Augmentation and web
+        fallback run on a bounded pool.
+
+    Returns one structured response per query, in input order, each equal
+    to what process_query_pipeline returns for that query alone.
+    """
+    if not queries:
+        return []
+
+    kb_keys = [kb_key for kb_key in active_kbs if kb_key in rag_engines]
+    contexts = [QueryEmbeddingContext(q) for q in queries]
+
+    # Stage 1a: one batched encode per distinct (model, backend)
+    encoder_for_key = {}
+    for kb_key in kb_keys:
+        engine = rag_engines[kb_key]
+        encoder_for_key.setdefault(embedding_key(engine), engine)
+
+    for key, engine in encoder_for_key.items():
+        query_embs = engine.encode_queries(list(queries))
+        for ctx, emb in zip(contexts, query_embs):
+            ctx.seed_query(key, emb)
+
+    # Stage 1b: one search per KB — merged per query in active_kbs order,
+    # the same order retrieve_from_kbs uses
+    retrieved = [[] for _ in queries]
+    for kb_key in kb_keys:
+        engine = rag_engines[kb_key]
+        query_matrix = np.vstack([ctx.query_embedding(engine) for ctx in contexts])
+        for i, kb_results in enumerate(engine.topk_retrieve_batch(query_matrix, TOP_K_RETRIEVE)):
+            for r in kb_results:
+                r["source_kb"] = kb_key
+                r["kb_model"] = engine.embedding_model_name
+                r["kb_backend"] = engine.embedding_backend
+            retrieved[i].extend(kb_results)
+
+    # Stage 2 prefetch: candidate vectors for all queries, per key. Its
+    # encodes serve every query at once, so they feed the histograms on a
+    # trace of their own rather than any one query's timings
+    prefetch_trace = new_trace()
+    by_key = {}
+    for results in retrieved:
+        for r in results:
+            by_key.setdefault(result_embedding_key(r), []).append(r)
+    for key, results in by_key.items():
+        if key in rerankers:
+            rerankers[key].candidate_vectors(results, rag_engines, trace=prefetch_trace)
+
+    # Stages 2-4 per query — vectors are cached, so this is mat-vecs only
+    states = [
+        rank_and_extract(q, results, [], rag_engines, rerankers, ctx)
+        for q, results, ctx in zip(queries, retrieved, contexts)
+    ]
+
+    # Stages 5-8 — LLM-bound, bounded concurrency
+    with ThreadPoolExecutor(max_workers=max(1, augment_concurrency)) as pool:
+        return list(pool.map(finish_query, queries, states, [rag_engines] * len(queries), contexts))
@@ -2,8 +2,43 @@
 # Cosine similarity over raw FAISS L2 distance — prevents topic mismatch
 # (e.g. "Python snakes" ranking above "Python exception handling").
 # Batched for efficiency: 3-5x faster than sequential encoding.
+# Index-backed mode skips encoding entirely — candidates were already embedded
+# by the same model at index-build time, so their vectors come from FAISS.
 # Part of ask_ai.py. Not standalone.
 
+# Index types whose reconstruct() returns a lossy approximation, not the vector
+# that was added. Scoring against those would silently shift rerank scores.
+LOSSY_INDEX_TYPES = (faiss.IndexPQ, faiss.IndexIVFPQ)
+
+# Scalar-quantized storage (fp16 / sq8) reconstructs approximately; the build
+# measures how closely (vector_fidelity). Below this mean cosine, re-encode.
+MIN_RECONSTRUCT_FIDELITY = 0.99
+
+
+def index_can_reconstruct(index, vector_storage: str = "fp32", vector_fidelity: dict = None) -> bool:
+    """
+    True if the index hands back vectors close enough to the ones it was
+    built from to score against.
+    Flat, HNSW-Flat and IVF-Flat (with a direct map) do. Their fp16 / sq8
+    variants do only when the blob's vector_fidelity shows a mean cosine of
+    at least MIN_RECONSTRUCT_FIDELITY — a compressed KB without a recorded
+    fidelity is not trusted. PQ-compressed indexes never do, and IVF without
+    a direct map raises on reconstruct.
+    """
+    if index is None or index.ntotal == 0:
+        return False
+    if vector_storage != "fp32" and (vector_fidelity or {}).get("mean_cosine", 0.0) < MIN_RECONSTRUCT_FIDELITY:
+        return False
+    index = faiss.downcast_index(index)
+    if isinstance(index, LOSSY_INDEX_TYPES):
+        return False
+    try:
+        index.reconstruct(0)
+        return True
+    except RuntimeError:
+        return False
+
+
 class LocalReranker:
     """
     Semantic reranker using the KB's own embedding model.
@@ -15,7 +50,31 @@ class LocalReranker:
         self.embedder = embedder
         self.batch_size = 32
 
-    def predict(self, pairs: list) -> list:
+    def _encode(self, texts: list, trace=None, model_name: str = "reranker") -> np.ndarray:
+        """
+        Encodes texts in batches of self.batch_size, L2-normalized.
+        Recorded as one encoder call on trace (a RequestTrace) when given.
+        """
+        trace = trace if trace is not None else NULL_TRACE
+        with trace.encoder(model_name, len(texts)):
+            if len(texts) <= self.batch_size:
+                return self.embedder.encode(
+                    texts,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+
+            all_embs = []
+            for i in range(0, len(texts), self.batch_size):
+                batch = texts[i:i + self.batch_size]
+                all_embs.append(self.embedder.encode(
+                    batch,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                ))
+            return np.vstack(all_embs)
+
+    def predict(self, pairs: list, query_emb: np.ndarray = None) -> list:
         """
         Scores query-candidate pairs by cosine similarity.
 
@@ -25,6 +84,11 @@ class LocalReranker:
         - Split result array back into query and candidate halves
         - Dot product of normalized vectors = cosine similarity
 
+        If query_emb is supplied (the pipeline passes the Stage 1 vector from
+        its QueryEmbeddingContext), every pair is assumed to share that query
+        and only the candidates are encoded — the query is never re-encoded
+        once per pair.
+
         Returns scores in [0, 1] — directly comparable across models
         because all embeddings are L2-normalized before scoring.
         """
@@ -32,26 +96,12 @@ class LocalReranker:
             return []
 
         query_texts, candidate_texts = zip(*pairs)
-        all_texts = list(query_texts) + list(candidate_texts)
 
-        # Batch encode
-        if len(all_texts) > self.batch_size:
-            all_embs = []
-            for i in range(0, len(all_texts), self.batch_size):
-                batch = all_texts[i:i + self.batch_size]
-                batch_embs = self.embedder.encode(
-                    batch,
-                    convert_to_numpy=True,
-                    normalize_embeddings=True
-                )
-                all_embs.append(batch_embs)
-            all_embs = np.vstack(all_embs)
-        else:
-            all_embs = self.embedder.encode(
-                all_texts,
-                convert_to_numpy=True,
-                normalize_embeddings=True
-            )
+        if query_emb is not None:
+            candidate_embs = self._encode(list(candidate_texts))
+            return [float(np.dot(query_emb.flatten(), c.flatten())) for c in candidate_embs]
+
+        all_embs = self._encode(list(query_texts) + list(candidate_texts))
 
         query_embs = all_embs[:len(query_texts)]
         candidate_embs = all_embs[len(query_texts):]
@@ -59,3 +109,80 @@ class LocalReranker:
         # Dot product of normalized vectors = cosine similarity
         return [float(np.dot(q.flatten(), c.flatten()))
                 for q, c in zip(query_embs, candidate_embs)]
+
+    def score_vectors(self, query_emb: np.ndarray, candidate_embs: np.ndarray) -> list:
+        """
+        Cosine similarity of one query against N candidates in a single
+        matrix-vector product. Candidate rows are normalized here because
+        merge_vector builds IndexFlatL2 from unnormalized encoder output.
+        """
+        candidate_embs = np.asarray(candidate_embs, dtype=np.float32)
+        norms = np.linalg.norm(candidate_embs, axis=1, keepdims=True)
+        candidate_embs = candidate_embs / np.where(norms == 0, 1e-12, norms)
+        return (candidate_embs @ query_emb.flatten()).astype(float).tolist()
+
+    def candidate_vectors(self, results: list, rag_engines: dict, trace=None) -> np.ndarray:
+        """
+        Returns one vector per result without re-encoding when avoidable.
+
+        Vector source, in order of preference:
+        1. r["rerank_embedding"] — cached by an earlier call (batch prefetch)
+        2. r["embedding"] — already attached by topk_retrieve, free
+        3. index.reconstruct_batch(ids) — one call per source KB, using the
+           faiss_id each result was retrieved under
+        4. self._encode(text) — only for rows whose index is lossy (PQ, or
+           fp16 / sq8 below MIN_RECONSTRUCT_FIDELITY) or can't reconstruct
+           at all, all in one batched pass
+
+        Every vector is cached on r["rerank_embedding"], so calling this once
+        over many queries' results (process_query_batch) makes each per-query
+        rerank free. Reconstructed vectors also go to r["embedding"] so Stage 7
+        consensus scoring reuses them. The fallback encode is recorded on
+        trace under the results' model and backend.
+        """
+        vectors = [None] * len(results)
+        pending_by_kb = {}
+
+        for i, r in enumerate(results):
+            emb = r.get("rerank_embedding")
+            if emb is None:
+                emb = r.get("embedding")
+            if isinstance(emb, np.ndarray):
+                vectors[i] = emb
+            elif r.get("faiss_id") is not None:
+                pending_by_kb.setdefault(r.get("source_kb"), []).append(i)
+
+        for kb_key, positions in pending_by_kb.items():
+            engine = rag_engines.get(kb_key)
+            if engine is None or not index_can_reconstruct(engine.index, engine.vector_storage,
+                                                            engine.vector_fidelity):
+                continue
+            ids = np.array([results[i]["faiss_id"] for i in positions], dtype=np.int64)
+            batch = engine.index.reconstruct_batch(ids)
+            for i, vec in zip(positions, batch):
+                vectors[i] = vec
+                results[i]["embedding"] = vec
+
+        # Fallback: re-encode only what the index couldn't give back
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            encoded = self._encode([results[i].get("text", "") for i in missing], trace,
+                                   _trace_label(result_embedding_key(results[missing[0]])))
+            for i, vec in zip(missing, encoded):
+                vectors[i] = vec
+
+        for r, vec in zip(results, vectors):
+            r["rerank_embedding"] = vec
+
+        return np.vstack(vectors)
+
+    def predict_from_index(self, query_emb: np.ndarray, results: list, rag_engines: dict,
+                           trace=None) -> list:
+        """
+        Scores retrieved results without re-encoding their text.
+        Vectors come from candidate_vectors; scoring is one mat-vec.
+        Scores are returned in results order.
+        """
+        if not results:
+            return []
+        return self.score_vectors(query_emb, self.candidate_vectors(results, rag_engines, trace))
@@ -2,6 +2,12 @@
 # KB files are self-describing — the embedding model and dimension live in
 # the metadata file, not in config or environment variables.
 # Dimension mismatch is caught at load time, not silently at query time.
+# Metadata is opened through open_meta_map — columnar .mmeta files are
+# memory-mapped and rows decoded on demand; legacy .pkl blobs still load.
+# Embedding models come from the shared EMBEDDER_REGISTRY — ten KBs on one
+# model hold one copy of it, not ten.
+# Approximate indexes (IVF, HNSW) get the nprobe / efSearch recorded at build
+# time, so recall at query time is the recall measured at build time.
 # Part of RAGEngine in ask_ai.py. Not standalone.
 
 def load_kb(self, kb_name: str, models_root: Path):
@@ -14,23 +20,34 @@ def load_kb(self, kb_name: str, models_root: Path):
 
     Validation order:
     1. Find latest versioned FAISS + metadata file pair
-    2. Load metadata, extract embedding_model and embedding_dim
-    3. Validate FAISS index dimension matches metadata declaration
-    4. Load embedding model, validate its output dimension matches both
+    2. Open metadata (.mmeta or legacy .pkl), extract embedding_model and embedding_dim
+    3. Validate FAISS index dimension matches metadata declaration, and
+       declared vector_storage (fp32 / fp16 / sq8) matches the index codes
+    4. Acquire embedding model from the shared registry with the backend the
+       KB declares (fp32 / int8_dynamic / onnx), validate its output
+       dimension matches both
     5. Validate document count matches FAISS vector count
+    6. Apply recorded search parameters (nprobe / efSearch) to IVF and
+       HNSW indexes; legacy blobs without index_type are flat
 
     Any mismatch raises RuntimeError immediately — no silent corruption.
     """
     faiss_file = self.find_latest_file(self.kb_path, "faiss_index", ".bin")
-    meta_file = self.find_latest_file(self.kb_path, "meta_map", ".pkl")
+    # Newest version wins regardless of format — the timestamp is in the stem
+    meta_candidates = [
+        f for f in (
+            self.find_latest_file(self.kb_path, "meta_map", f".{COLUMNAR_META_EXT}"),
+            self.find_latest_file(self.kb_path, "meta_map", ".pkl")
+        ) if f
+    ]
+    meta_file = max(meta_candidates, key=lambda f: f.stem) if meta_candidates else None
 
     if not faiss_file or not meta_file:
         raise RuntimeError(f"KB '{kb_name}' missing FAISS or metadata files")
 
     self.index = faiss.read_index(str(faiss_file))
 
-    with open(meta_file, "rb") as f:
-        meta_blob = pickle.load(f)
+    meta_blob, rows = open_meta_map(meta_file)
 
     self.meta_file_path = meta_file
 
@@ -46,12 +63,21 @@ def load_kb(self, kb_name: str, models_root: Path):
             f"KB '{kb_name}' dimension mismatch: FAISS={self.index.d}D vs Metadata={embed_dim}D"
         )
 
-    # Build per-document metadata list
-    documents = meta_blob.get("documents", [])
-    if not documents:
+    # Compact storage: fp16 / sq8 codes reconstruct approximate vectors; the
+    # declaration must match the index, and the build-time fidelity decides
+    # whether reranking reads them back or re-encodes (index_can_reconstruct)
+    vector_storage = meta_blob.get("vector_storage", "fp32")
+    if index_vector_storage(self.index) != vector_storage:
+        raise RuntimeError(
+            f"KB '{kb_name}' storage mismatch: metadata declares {vector_storage}, "
+            f"index holds {index_vector_storage(self.index)}"
+        )
+
+    # Per-document metadata: lazy columnar view, or expanded list for legacy .pkl
+    if len(rows) == 0:
         raise RuntimeError(f"KB '{kb_name}' contains no documents")
 
-    self.meta = [dict(metadata) | {"text": text} for text, metadata in documents]
+    self.meta = rows
 
     # Validate document count matches vector count
     if len(self.meta) != self.index.ntotal:
@@ -65,14 +91,44 @@ def load_kb(self, kb_name: str, models_root: Path):
     if not model_path.exists():
         raise FileNotFoundError(f"Embedding model not found: {model_path}")
 
-    self.embedder = SentenceTransformer(str(model_path))
-    test_dim = self.embedder.encode(["test"], convert_to_numpy=True).shape[1]
+    # The backend that built the KB is the backend that queries it
+    embed_backend = backend_of(meta_blob)
+    if embed_backend not in EMBEDDING_BACKENDS:
+        raise RuntimeError(f"KB '{kb_name}' declares unknown embedding backend '{embed_backend}'")
+
+    shared = EMBEDDER_REGISTRY.acquire(model_path, kb_name, embed_backend)
+    test_dim = shared["dim"]
 
     if test_dim != embed_dim:
+        EMBEDDER_REGISTRY.release(model_path, kb_name, embed_backend)
         raise RuntimeError(
             f"Model '{embed_model_name}' produces {test_dim}D but KB declares {embed_dim}D"
         )
 
-    self.reranker = LocalReranker(self.embedder)
+    self.embedder = shared["embedder"]
+    self.reranker = shared["reranker"]
+    self.model_path = model_path
+    self.kb_name = kb_name
     self.embedding_model_name = embed_model_name
     self.embedding_dim = embed_dim
+    self.embedding_backend = embed_backend
+    self.vector_storage = vector_storage
+    self.vector_fidelity = meta_blob.get("vector_fidelity")
+
+    # Approximate index: honour the build-time search parameters
+    self.index_type = meta_blob.get("index_type", "flat")
+    apply_search_params(self.index, meta_blob.get("index_params"))
+
+
+def unload_kb(self):
+    """
+    Releases this KB's hold on its shared embedder.
+    The model is freed only when no other loaded KB still uses it.
+    Called by /api/kb/unload before the engine is dropped from rag_engines.
+    """
+    if getattr(self, "model_path", None) is not None:
+        EMBEDDER_REGISTRY.release(self.model_path, self.kb_name, self.embedding_backend)
+    self.embedder = None
+    self.reranker = None
+    self.index = None
+    self.meta = None
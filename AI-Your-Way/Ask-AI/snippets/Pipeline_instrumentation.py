@@ -0,0 +1,214 @@
+# Demonstrates: Low-overhead per-stage instrumentation for the query pipeline.
+# Scores alone can't say whether a slow p95 is retrieval, reranking,
+# augmentation, web fallback or consensus scoring. Each request carries a
+# trace that times stages, encoder calls, LLM calls and per-KB searches,
+# feeds rolling histograms, and can be returned as a "timings" field.
+# Part of ask_ai.py. Not standalone.
+
+# Master switch. When False every request gets NULL_TRACE, whose methods are
+# no-ops returning a shared nullcontext — no clock reads, no allocation.
+PIPELINE_METRICS_ENABLED = True
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+HISTOGRAM_WINDOW = 1024   # recent observations kept for p50/p95
+
+# family name -> (help text, label name, buckets)
+METRIC_FAMILIES = {
+    "askai_stage_seconds":       ("Wall time per pipeline stage", "stage", LATENCY_BUCKETS),
+    "askai_kb_search_seconds":   ("FAISS search time per KB", "kb", LATENCY_BUCKETS),
+    "askai_encoder_seconds":     ("Encoder call wall time per model", "model", LATENCY_BUCKETS),
+    "askai_encoder_batch_size":  ("Texts per encoder call", "model", SIZE_BUCKETS),
+    "askai_llm_seconds":         ("LLM call wall time per agent", "agent", LATENCY_BUCKETS),
+    "askai_candidates":          ("Retrieved candidates per query", "stage", SIZE_BUCKETS),
+}
+
+
+def _escape_label_value(value: str) -> str:
+    """
+    Text-format escaping for label values: backslash, double quote and
+    newline. KB keys and model names come from directory names and
+    metadata, so any of them can appear.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RollingHistogram:
+    """
+    Prometheus-style cumulative buckets (monotonic since process start) plus
+    a bounded window of recent values for p50/p95 in debug snapshots.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=HISTOGRAM_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.bucket_counts[i] += 1
+
+    def snapshot(self) -> dict:
+        recent = sorted(self.window)
+        pick = lambda q: recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.0
+        return {"count": self.count, "sum": round(self.total, 6), "p50": pick(0.50), "p95": pick(0.95)}
+
+
+class PipelineMetrics:
+    """Process-wide histogram registry: (family, label value) -> RollingHistogram."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, family: str, label: str, value: float):
+        with self._lock:
+            hist = self._histograms.get((family, label))
+            if hist is None:
+                hist = self._histograms[(family, label)] = RollingHistogram(METRIC_FAMILIES[family][2])
+            hist.observe(value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {f"{family}{{{label}}}": hist.snapshot()
+                    for (family, label), hist in sorted(self._histograms.items())}
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for family, (help_text, label_name, buckets) in METRIC_FAMILIES.items():
+                series = sorted((label, h) for (f, label), h in self._histograms.items() if f == family)
+                if not series:
+                    continue
+                lines.append(f"# HELP {family} {help_text}")
+                lines.append(f"# TYPE {family} histogram")
+                for label, hist in series:
+                    tag = f'{label_name}="{_escape_label_value(label)}"'
+                    for upper, n in zip(buckets, hist.bucket_counts):
+                        lines.append(f'{family}_bucket{{{tag},le="{upper}"}} {n}')
+                    lines.append(f'{family}_bucket{{{tag},le="+Inf"}} {hist.count}')
+                    lines.append(f"{family}_sum{{{tag}}} {hist.total:.6f}")
+                    lines.append(f"{family}_count{{{tag}}} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+PIPELINE_METRICS = PipelineMetrics()
+
+
+class RequestTrace:
+    """
+    Per-request timings. Carried on the request's QueryEmbeddingContext
+    (emb_ctx.trace), since that object already reaches every stage —
+    including Stage 1 worker threads.
+    """
+
+    def __init__(self, metrics=PIPELINE_METRICS):
+        self.metrics = metrics
+        self.stages = {}
+        self.kb_searches = {}
+        self.encoder_calls = []
+        self.llm_calls = []
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            self.metrics.observe("askai_stage_seconds", name, elapsed)
+
+    @contextmanager
+    def encoder(self, model_name: str, batch_size: int):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.encoder_calls.append({"model": model_name, "batch": batch_size, "s": elapsed})
+            self.metrics.observe("askai_encoder_seconds", model_name, elapsed)
+            self.metrics.observe("askai_encoder_batch_size", model_name, batch_size)
+
+    @contextmanager
+    def llm(self, agent: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.llm_calls.append({"agent": agent, "s": elapsed})
+            self.metrics.observe("askai_llm_seconds", agent, elapsed)
+
+    @contextmanager
+    def kb_search(self, kb_key: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.kb_searches[kb_key] = elapsed
+            self.metrics.observe("askai_kb_search_seconds", kb_key, elapsed)
+
+    def count(self, name: str, value: int):
+        self.counts[name] = value
+        self.metrics.observe("askai_candidates", name, value)
+
+    def summary(self) -> dict:
+        """The response's "timings" field — milliseconds, rounded."""
+        ms = lambda s: round(s * 1000, 2)
+        return {
+            "stages_ms": {k: ms(v) for k, v in self.stages.items()},
+            "kb_search_ms": {k: ms(v) for k, v in self.kb_searches.items()},
+            "encoder_calls": [{"model": c["model"], "batch": c["batch"], "ms": ms(c["s"])}
+                              for c in self.encoder_calls],
+            "llm_calls": [{"agent": c["agent"], "ms": ms(c["s"])} for c in self.llm_calls],
+            "counts": dict(self.counts)
+        }
+
+
+class _NullTrace:
+    """Instrumentation switched off: every call is a no-op."""
+
+    _NULL = nullcontext()
+
+    def stage(self, name):
+        return self._NULL
+
+    def encoder(self, model_name, batch_size):
+        return self._NULL
+
+    def llm(self, agent):
+        return self._NULL
+
+    def kb_search(self, kb_key):
+        return self._NULL
+
+    def count(self, name, value):
+        pass
+
+    def summary(self):
+        return None
+
+
+NULL_TRACE = _NullTrace()
+
+
+def new_trace():
+    return RequestTrace() if PIPELINE_METRICS_ENABLED else NULL_TRACE
+
+
+# Local scrape endpoint (bind to localhost only, like the rest of the API):
+#
+#   @app.route("/metrics")
+#   def metrics():
+#       return Response(PIPELINE_METRICS.render_prometheus(),
+#                       mimetype="text/plain; version=0.0.4")
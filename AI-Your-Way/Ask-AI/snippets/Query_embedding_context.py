@@ -0,0 +1,115 @@
+# Demonstrates: Per-request embedding context shared across pipeline stages.
+# Several KBs often declare the same embedding_model, and the reranker used to
+# re-encode the query once per candidate pair. The context encodes the query
+# exactly once per distinct (model, backend) and hands the same vector to
+# every stage.
+# Answer embeddings are memoized too, so the augmentation gate and RAG
+# consensus scoring share vectors instead of encoding the same text twice.
+# Part of ask_ai.py query pipeline. Not standalone.
+
+def embedding_key(engine) -> tuple:
+    """
+    (embedding_model_name, embedding_backend) — the identity of a vector space.
+    An int8_dynamic or onnx encoder of a model gives vectors close to, not
+    equal to, its fp32 encoder, so a KB must be searched, reranked and scored
+    with vectors from its own backend, never with a sibling KB's.
+    """
+    return (engine.embedding_model_name, engine.embedding_backend)
+
+
+def result_embedding_key(r: dict) -> tuple:
+    """embedding_key of the KB a Stage 1 result came from (kb_model, kb_backend)."""
+    return (r.get("kb_model", "unknown"), r.get("kb_backend", "fp32"))
+
+
+def _trace_label(key: tuple) -> str:
+    """Encoder histogram label: the model name, suffixed when not fp32."""
+    model_name, backend = key
+    return model_name if backend == "fp32" else f"{model_name}:{backend}"
+
+
+class QueryEmbeddingContext:
+    """
+    Lives for exactly one call to process_query_pipeline.
+    Keyed by embedding_key — two KBs built with the same model and backend
+    share one query vector; KBs on different models, or on the same model
+    through different backends, never do.
+    """
+
+    def __init__(self, query_text: str, trace=None):
+        self.query_text = query_text
+        self.trace = trace if trace is not None else new_trace()   # per-request timings
+        self._query_embs = {}     # embedding_key -> raw encode_query output (FAISS input)
+        self._text_embs = {}      # (embedding_key, text) -> normalized answer embedding
+        self._model_locks = {}
+        self._lock = threading.Lock()
+        self.encode_calls = 0
+
+    def _model_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._model_locks.setdefault(key, threading.Lock())
+
+    def query_embedding(self, engine) -> np.ndarray:
+        """
+        Stage 1 — returns the query vector for this engine's model and backend.
+
+        Safe under concurrent retrieval: KBs sharing an embedding_key block
+        on its lock while the first one encodes, then reuse its vector.
+        KBs with different keys encode in parallel.
+        """
+        key = embedding_key(engine)
+        with self._model_lock(key):
+            if key not in self._query_embs:
+                with self.trace.encoder(_trace_label(key), 1):
+                    self._query_embs[key] = engine.encode_query(self.query_text)
+                self.encode_calls += 1
+        return self._query_embs[key]
+
+    def seed_query(self, key: tuple, emb: np.ndarray):
+        """
+        Stores a query vector computed elsewhere — process_query_batch encodes
+        every query for an embedding_key in one batch and seeds each
+        request's context.
+        """
+        with self._model_lock(key):
+            if key not in self._query_embs:
+                self._query_embs[key] = emb
+
+    def normalized_query(self, key: tuple):
+        """
+        Stage 2 — L2-normalized query vector for the reranker.
+        Normalizing here is idempotent if encode_query already normalizes.
+        Returns None if no KB with this embedding_key was retrieved.
+        """
+        emb = self._query_embs.get(key)
+        if emb is None:
+            return None
+        emb = np.asarray(emb, dtype=np.float32).flatten()
+        return emb / (np.linalg.norm(emb) + 1e-12)
+
+    def text_embeddings(self, key: tuple, embedder, texts: list) -> list:
+        """
+        Normalized embeddings for arbitrary texts (candidate and final answers),
+        memoized per (embedding_key, text) for the lifetime of the request.
+        embedder must be the encoder of the KB that key came from.
+
+        All texts not yet seen are encoded in ONE encoder call. Stage 5 asks
+        for [kb_answer, augmented] together; Stage 7 then asks for the final
+        answer, which is almost always one of those two — a memo hit, not a
+        third forward pass.
+        """
+        with self._model_lock(key):
+            missing = list(dict.fromkeys(
+                t for t in texts if (key, t) not in self._text_embs
+            ))
+            if missing:
+                with self.trace.encoder(_trace_label(key), len(missing)):
+                    embs = embedder.encode(missing, convert_to_numpy=True, normalize_embeddings=True)
+                for text, emb in zip(missing, embs):
+                    self._text_embs[(key, text)] = emb
+                self.encode_calls += 1
+            return [self._text_embs[(key, t)] for t in texts]
+
+    def text_embedding(self, key: tuple, embedder, text: str) -> np.ndarray:
+        """Single-text form of text_embeddings — Stage 7 answer lookup."""
+        return self.text_embeddings(key, embedder, [text])[0]
@@ -3,139 +3,369 @@
 # augmentation, validation, confidence scoring, web fallback.
 # Part of ask_ai.py. Not standalone.
 
-def process_query_pipeline(query_text, active_kbs, rag_engines, rerankers):
+# Stage 1 concurrency — FAISS search and SentenceTransformer encode both release
+# the GIL, so a small thread pool overlaps per-KB retrieval instead of queuing it.
+ENABLE_CONCURRENT_RETRIEVAL = True
+RETRIEVAL_MAX_WORKERS = 4      # bounded — never one thread per KB
+RETRIEVAL_KB_TIMEOUT = 2.0     # seconds per KB, from when its search starts, before its results are dropped
+RETRIEVAL_QUEUE_TIMEOUT = 2.0   # seconds a KB may wait for a free worker before it is skipped
+
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS,
+    thread_name_prefix="kb_retrieve"
+)
+
+
+def _retrieve_from_kb(emb_ctx, kb_key, engine):
     """
-    Full query pipeline. Eight stages, three LLMs, one structured response.
+    Stage 1 work unit for a single KB: encode with the KB's own model, search,
+    annotate. Shared by the serial and concurrent paths so both produce
+    identical result dicts. The query vector comes from the request's
+    QueryEmbeddingContext, so KBs sharing a model share one encode.
+    """
+    query_emb = emb_ctx.query_embedding(engine)
+    with emb_ctx.trace.kb_search(kb_key):
+        kb_results = engine.topk_retrieve(query_emb, TOP_K_RETRIEVE)
+    for r in kb_results:
+        r["source_kb"] = kb_key
+        r["kb_model"] = engine.embedding_model_name
+        r["kb_backend"] = engine.embedding_backend
+    return kb_results
 
-    Stage 1 — Multi-KB retrieval:
-        Query each active KB with its own embedding model via FAISS.
-        Each result annotated with source_kb and kb_model for downstream routing.
 
-    Stage 2 — Per-model reranking:
-        Group results by embedding model. Rerank each group with its own
-        LocalReranker instance. Prevents cross-model score contamination.
+def _timed_retrieve(started, emb_ctx, kb_key, engine):
+    """Pool task: records when the KB's search actually began, then runs it."""
+    started[kb_key] = time.monotonic()
+    return _retrieve_from_kb(emb_ctx, kb_key, engine)
 
-    Stage 3 — Cross-KB score fusion:
-        Merge all reranked groups, sort by rerank score descending.
-        Rerank scores are comparable across models (normalized cosine [0,1]).
 
-    Stage 4 — Answer extraction:
-        Pull text from best-scoring entry. Clean wiki artifacts and footnotes.
+def _await_kb(future, started, kb_key, submitted):
+    """
+    future.result() on the KB's own clock: RETRIEVAL_KB_TIMEOUT from the
+    moment its task started, so time spent queued behind other KBs (or
+    other requests) is not charged to it. While it is still queued, the
+    wait is capped at RETRIEVAL_QUEUE_TIMEOUT from submission.
+    """
+    while True:
+        start = started.get(kb_key)
+        deadline = (start + RETRIEVAL_KB_TIMEOUT if start is not None
+                    else submitted + RETRIEVAL_QUEUE_TIMEOUT)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            if started.get(kb_key) == start:   # no state change — this deadline really passed
+                raise
+            # it left the queue while we waited: re-arm on its start time
 
-    Stage 5 — LLM augmentation (optional):
-        Reasoning agent (8B) refines answer for clarity.
-        Gated by augmentation_validation — rejected if keyword overlap < 30%
-        or embedding similarity < 70%.
 
-    Stage 6 — Confidence scoring:
-        Five weighted signals: outcome type, user feedback, RAG consensus,
-        rerank score, statistical baseline. Normalized [-1,1] → [0,1].
+def retrieve_from_kbs(emb_ctx, active_kbs, rag_engines, concurrent=ENABLE_CONCURRENT_RETRIEVAL):
+    """
+    Stage 1 — Multi-KB retrieval, serial or concurrent.
 
-    Stage 7 — Web fallback:
-        DuckDuckGo search activates only if KB produced no answer.
-        5-second timeout. Snippet truncated at sentence boundary.
+    Concurrent mode submits one task per KB to a shared, bounded thread pool.
+    Every KB gets RETRIEVAL_KB_TIMEOUT seconds measured from when its own
+    search starts, so with more KBs than workers the queued ones are not
+    timed out for waiting; a KB that cannot get a worker within
+    RETRIEVAL_QUEUE_TIMEOUT, times out or raises contributes no results and
+    is reported by name, so one slow or broken index cannot stall the query.
 
-    Stage 8 — Structured response:
-        Returns answer, all scoring signals, source metadata, session length.
+    A timed-out search is abandoned, not stopped: Python cannot interrupt
+    a thread, so it runs to completion in its worker, holding that slot,
+    and its results are discarded.
+
+    Why results are merged in active_kbs order, not completion order:
+    Stage 3 sorts by rerank score with a stable sort, so ties keep insertion
+    order. Merging as futures complete would make tie-breaking depend on thread
+    scheduling — the same query could return a different best_entry run to run.
+    Collecting per KB and concatenating in request order keeps the concurrent
+    path byte-for-byte identical to the serial one.
+
+    Returns (all_retrieved, failed_kbs).
     """
+    kb_keys = [kb_key for kb_key in active_kbs if kb_key in rag_engines]
+    failed_kbs = []
+
+    if not concurrent or len(kb_keys) < 2:
+        all_retrieved = []
+        for kb_key in kb_keys:
+            all_retrieved.extend(_retrieve_from_kb(emb_ctx, kb_key, rag_engines[kb_key]))
+        return all_retrieved, failed_kbs
+
+    started = {}
+    submitted = time.monotonic()
+    futures = {
+        kb_key: RETRIEVAL_EXECUTOR.submit(_timed_retrieve, started, emb_ctx, kb_key, rag_engines[kb_key])
+        for kb_key in kb_keys
+    }
+
+    results_by_kb = {}
+    for kb_key, future in futures.items():
+        try:
+            results_by_kb[kb_key] = _await_kb(future, started, kb_key, submitted)
+        except FuturesTimeoutError:
+            future.cancel()  # no-op if already running; frees the slot if still queued
+            failed_kbs.append(kb_key)
+            if kb_key in started:
+                print(f"[WARN] KB '{kb_key}' retrieval exceeded {RETRIEVAL_KB_TIMEOUT}s — skipped")
+            else:
+                print(f"[WARN] KB '{kb_key}' got no worker within {RETRIEVAL_QUEUE_TIMEOUT}s — skipped")
+        except Exception as e:
+            failed_kbs.append(kb_key)
+            print(f"[WARN] KB '{kb_key}' retrieval failed: {e}")
+
+    # Deterministic merge: request order, never completion order
     all_retrieved = []
+    for kb_key in kb_keys:
+        all_retrieved.extend(results_by_kb.get(kb_key, []))
+
+    return all_retrieved, failed_kbs
 
+
+def run_retrieval_stages(query_text, active_kbs, rag_engines, rerankers, emb_ctx):
+    """
+    Stages 1-4: retrieve, rerank, fuse, extract.
+
+    Everything up to the KB_DIRECT answer — no LLM involved. Shared by the
+    synchronous pipeline and the streaming one, which emits this answer
+    before augmentation starts. Returns the pipeline state as a dict.
+    """
     # Stage 1: Multi-KB retrieval
-    for kb_key in active_kbs:
-        if kb_key not in rag_engines:
-            continue
-        engine = rag_engines[kb_key]
-        query_emb = engine.encode_query(query_text)
-        kb_results = engine.topk_retrieve(query_emb, TOP_K_RETRIEVE)
-        for r in kb_results:
-            r["source_kb"] = kb_key
-            r["kb_model"] = engine.embedding_model_name
-        all_retrieved.extend(kb_results)
+    with emb_ctx.trace.stage("retrieval"):
+        all_retrieved, failed_kbs = retrieve_from_kbs(emb_ctx, active_kbs, rag_engines)
+
+    return rank_and_extract(query_text, all_retrieved, failed_kbs, rag_engines, rerankers, emb_ctx)
+
 
-    # Stage 2: Per-model reranking (grouped by model)
+def rank_and_extract(query_text, all_retrieved, failed_kbs, rag_engines, rerankers, emb_ctx):
+    """
+    Stages 2-4 over already-retrieved results. Split from Stage 1 so
+    process_query_batch can retrieve for many queries at once and still
+    rank each one through exactly this code.
+    """
+    emb_ctx.trace.count("retrieved", len(all_retrieved))
+
+    # Stage 2: Per-model reranking (grouped by model and backend)
     reranked, scores = [], []
     by_model = {}
     for r in all_retrieved:
-        by_model.setdefault(r.get("kb_model", "unknown"), []).append(r)
+        by_model.setdefault(result_embedding_key(r), []).append(r)
 
-    for model, results in by_model.items():
-        if model in rerankers:
-            model_reranked, model_scores = rerank_results(query_text, results, rerankers[model])
-            reranked.extend(model_reranked)
-            scores.extend(model_scores)
+    with emb_ctx.trace.stage("rerank"):
+        for key, results in by_model.items():
+            if key not in rerankers:
+                continue
+            query_emb = emb_ctx.normalized_query(key)
+            if query_emb is not None:
+                # Index-backed: stored vectors, one mat-vec, no encoder passes
+                model_scores = rerankers[key].predict_from_index(query_emb, results, rag_engines,
+                                                                 trace=emb_ctx.trace)
+                reranked.extend(results)
+                scores.extend(model_scores)
+            else:
+                model_reranked, model_scores = rerank_results(query_text, results, rerankers[key])
+                reranked.extend(model_reranked)
+                scores.extend(model_scores)
 
     # Stage 3: Cross-KB score fusion
-    if reranked:
-        combined = sorted(zip(reranked, scores), key=lambda x: x[1], reverse=True)
-        reranked, scores = map(list, zip(*combined))
+    with emb_ctx.trace.stage("fusion"):
+        if reranked:
+            combined = sorted(zip(reranked, scores), key=lambda x: x[1], reverse=True)
+            reranked, scores = map(list, zip(*combined))
 
     # Stage 4: Answer extraction
     best_entry = reranked[0] if reranked else None
-    best_rerank_score = scores[0] if scores else 0.0
-    source_kb = best_entry.get("source_kb") if best_entry else None
     best_answer_raw = extract_text(best_entry).strip() if best_entry else None
 
-    answer, kb_answer, source_type, augmented = "", None, "NONE", False
+    state = {
+        "all_retrieved": all_retrieved,
+        "failed_kbs": failed_kbs,
+        "reranked": reranked,
+        "best_rerank_score": scores[0] if scores else 0.0,
+        "source_kb": best_entry.get("source_kb") if best_entry else None,
+        "kb_answer": None,
+        "answer": "",
+        "source_type": "NONE"
+    }
 
-    # Stage 5: Augmentation with validation gate
     if best_answer_raw and len(best_answer_raw) > 20:
-        kb_answer = clean_kb_text(best_answer_raw)
-        answer = format_answer_human_readable(kb_answer)
-        source_type = "KB_DIRECT"
+        state["kb_answer"] = clean_kb_text(best_answer_raw)
+        state["answer"] = format_answer_human_readable(state["kb_answer"])
+        state["source_type"] = "KB_DIRECT"
 
-        if ENABLE_LLM_AUGMENTATION and best_rerank_score >= AUGMENTATION_MIN_RERANK:
-            answer, augmented = augment_answer_with_llm(
-                kb_answer, query_text, reranked, source_kb, rag_engines
-            )
-            if augmented:
-                source_type = "KB_AUGMENTED"
+    return state
 
-    # Stage 6: Web fallback
-    if not answer or answer in ["LLM_FAIL", "LLM_UNAVAILABLE"]:
-        web_result = online_fallback(query_text, use_async=True)
-        if web_result.startswith("WEB_SUCCESS"):
-            answer = web_result.split(": ", 1)[-1]
-            source_type = "WEB"
-        else:
-            answer = "I couldn't find an answer in my knowledge base or online."
-            source_type = "FAIL"
 
-    # Stage 7: Confidence scoring
+def should_augment(state) -> bool:
+    """Stage 5 gate — only confident KB answers are worth an 8B call."""
+    return (
+        state["source_type"] == "KB_DIRECT"
+        and ENABLE_LLM_AUGMENTATION
+        and state["best_rerank_score"] >= AUGMENTATION_MIN_RERANK
+    )
+
+
+def needs_web_fallback(answer) -> bool:
+    return not answer or answer in ["LLM_FAIL", "LLM_UNAVAILABLE"]
+
+
+def resolve_web_fallback(web_result) -> tuple:
+    """Maps an online_fallback result string to (answer, source_type)."""
+    if web_result and web_result.startswith("WEB_SUCCESS"):
+        return web_result.split(": ", 1)[-1], "WEB"
+    return "I couldn't find an answer in my knowledge base or online.", "FAIL"
+
+
+def score_answer(state, answer, source_type, rag_engines, emb_ctx) -> tuple:
+    """
+    Confidence scoring for one candidate answer. Returns (confidence, rag_score).
+    Called once by the synchronous pipeline, and once per emitted answer by
+    the streaming pipeline — the memoized answer embeddings keep that cheap.
+
+    Snippet vectors are the reconstructed r["embedding"] where the index can
+    give them back, else the reranker's r["rerank_embedding"] — the only
+    vector a PQ or low-fidelity fp16 / sq8 result has after Stage 2.
+    """
+    reranked, source_kb = state["reranked"], state["source_kb"]
+
     rag_score = 0.0
     if reranked and source_kb in rag_engines:
-        try:
-            engine = rag_engines[source_kb]
-            snippet_embs = np.array([
-                r["embedding"] for r in reranked
-                if isinstance(r.get("embedding"), np.ndarray)
-            ])
-            if snippet_embs.size > 0:
-                answer_emb = engine.embedder.encode(
-                    [answer], convert_to_numpy=True, normalize_embeddings=True
-                )
-                rag_score = engine.rag_consensus_signal(answer_emb, snippet_embs)
-        except Exception:
-            pass
+        with emb_ctx.trace.stage("scoring"):
+            try:
+                engine = rag_engines[source_kb]
+                snippet_embs = [
+                    r["embedding"] if isinstance(r.get("embedding"), np.ndarray) else r.get("rerank_embedding")
+                    for r in reranked
+                ]
+                snippet_embs = np.array([e for e in snippet_embs if isinstance(e, np.ndarray)])
+                if snippet_embs.size > 0:
+                    answer_emb = emb_ctx.text_embedding(
+                        embedding_key(engine), engine.embedder, answer
+                    )
+                    rag_score = engine.rag_consensus_signal(answer_emb, snippet_embs)
+            except Exception:
+                pass
 
     confidence = compute_confidence({
         "outcome": OUTCOME_MAP.get(source_type, 0.0),
         "user": 0.0,
         "rag": rag_score,
-        "rerank": best_rerank_score,
+        "rerank": state["best_rerank_score"],
         "stat": 0.5
     })
 
-    # Stage 8: Structured response
+    return confidence, rag_score
+
+
+def build_response(query_text, state, answer, source_type, augmented, confidence, rag_score) -> dict:
+    """Stage 8: Structured response."""
     return {
         "status": "success",
         "query": query_text,
         "answer": answer,
-        "kb_answer": kb_answer,
+        "kb_answer": state["kb_answer"],
         "source_type": source_type,
-        "source_kb": source_kb,
+        "source_kb": state["source_kb"],
         "confidence": confidence,
-        "rerank_score": best_rerank_score,
+        "rerank_score": state["best_rerank_score"],
         "rag_score": rag_score,
-        "retrieved_count": len(all_retrieved),
+        "retrieved_count": len(state["all_retrieved"]),
+        "failed_kbs": state["failed_kbs"],
         "augmented": augmented
     }
+
+
+def finish_query(query_text, state, rag_engines, emb_ctx) -> dict:
+    """
+    Stages 5-8 over the state from Stages 1-4. The one implementation shared
+    by process_query_pipeline and process_query_batch, so a batched query
+    gets the same answer — and the same trace spans — as a single one.
+    """
+    answer, source_type, augmented = state["answer"], state["source_type"], False
+
+    # Stage 5: Augmentation with validation gate
+    if should_augment(state):
+        with emb_ctx.trace.stage("augmentation"):
+            answer, augmented = augment_answer_with_llm(
+                state["kb_answer"], query_text, state["reranked"], state["source_kb"],
+                rag_engines, emb_ctx=emb_ctx
+            )
+        if augmented:
+            source_type = "KB_AUGMENTED"
+
+    # Stage 6: Web fallback
+    if needs_web_fallback(answer):
+        with emb_ctx.trace.stage("web_fallback"):
+            answer, source_type = resolve_web_fallback(online_fallback(query_text, use_async=True))
+
+    # Stage 7: Confidence scoring
+    confidence, rag_score = score_answer(state, answer, source_type, rag_engines, emb_ctx)
+
+    # Stage 8: Structured response
+    return build_response(query_text, state, answer, source_type, augmented, confidence, rag_score)
+
+
+def process_query_pipeline(query_text, active_kbs, rag_engines, rerankers, emb_ctx=None,
+                           include_timings=False):
+    """
+    Full query pipeline. Eight stages, three LLMs, one structured response.
+
+    Stage 1 — Multi-KB retrieval:
+        Query each active KB with its own embedding model and backend via FAISS.
+        Each result annotated with source_kb, kb_model and kb_backend for
+        downstream routing.
+        KBs are searched concurrently on a bounded pool with per-KB timeouts;
+        results merge in active_kbs order so fusion matches the serial path.
+
+    Stage 2 — Per-model reranking:
+        Group results by embedding_key (model, backend). Rerank each group
+        with its own LocalReranker instance — rerankers is keyed the same
+        way (rerankers_for). Prevents cross-model score contamination.
+        The reranker reuses the Stage 1 query vector from the request's
+        QueryEmbeddingContext — each key encodes the query once per request.
+        Candidate vectors come from the FAISS index (reconstruct_batch), so
+        candidates are only re-encoded when the index is lossy (PQ).
+
+    Stage 3 — Cross-KB score fusion:
+        Merge all reranked groups, sort by rerank score descending.
+        Rerank scores are comparable across models (normalized cosine [0,1]).
+
+    Stage 4 — Answer extraction:
+        Pull text from best-scoring entry. Clean wiki artifacts and footnotes.
+
+    Stage 5 — LLM augmentation (optional):
+        Reasoning agent (8B) refines answer for clarity.
+        Gated by augmentation_validation — rejected if keyword overlap < 30%
+        or embedding similarity < 70%. Both answers are encoded in one batch
+        and memoized for Stage 7.
+
+    Stage 6 — Confidence scoring:
+        Five weighted signals: outcome type, user feedback, RAG consensus,
+        rerank score, statistical baseline. Normalized [-1,1] → [0,1].
+        The answer embedding for RAG consensus is a memo hit whenever the
+        final answer is the KB or augmented text Stage 5 already encoded.
+
+    Stage 7 — Web fallback:
+        DuckDuckGo search activates only if KB produced no answer.
+        5-second timeout. Snippet truncated at sentence boundary.
+
+    Stage 8 — Structured response:
+        Returns answer, all scoring signals, source metadata, session length.
+
+    emb_ctx may be supplied by a caller that already encoded the query
+    (the semantic answer cache); otherwise a fresh one is created.
+
+    include_timings adds a "timings" field: per-stage wall time, per-KB
+    search time, encoder calls with batch sizes, LLM calls and candidate
+    counts. Histograms are fed either way while PIPELINE_METRICS_ENABLED.
+    """
+    if emb_ctx is None:
+        emb_ctx = QueryEmbeddingContext(query_text)
+
+    # Stages 1-4: Retrieval, reranking, fusion, answer extraction
+    state = run_retrieval_stages(query_text, active_kbs, rag_engines, rerankers, emb_ctx)
+
+    # Stages 5-8: Augmentation, web fallback, confidence, response
+    response = finish_query(query_text, state, rag_engines, emb_ctx)
+    if include_timings:
+        response["timings"] = emb_ctx.trace.summary()
+    return response
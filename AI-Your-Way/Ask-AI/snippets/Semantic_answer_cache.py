@@ -0,0 +1,168 @@
+# Demonstrates: Semantic answer cache in front of the query pipeline.
+# Repeated and near-duplicate questions used to pay for retrieval, reranking,
+# augmentation and scoring every time. The cache matches on query embedding
+# similarity, scoped to the exact KB set and KB versions that produced the answer.
+# Part of ask_ai.py. Not standalone.
+
+ANSWER_CACHE_MAX_ENTRIES = 2048
+ANSWER_CACHE_TTL_SECONDS = 6 * 60 * 60
+ANSWER_CACHE_MIN_COSINE = 0.95   # near-duplicate phrasing, not merely the same topic
+ANSWER_CACHE_SEARCH_K = 8        # neighbours checked per lookup — the nearest may be expired
+
+# Answers that should be recomputed rather than replayed
+UNCACHEABLE_SOURCE_TYPES = {"FAIL"}
+
+
+class SemanticAnswerCache:
+    """
+    LRU + TTL cache of structured responses, looked up by cosine similarity.
+
+    Scope = (kb_key, meta_file_path) for every active KB, in request order.
+    Loading a newer versioned index changes meta_file_path, so the scope
+    changes and stale answers simply stop matching — no explicit flush.
+    Entries from the old scope age out through LRU and TTL.
+
+    Each scope has its own small inner-product index (FAISS IDMap2 over a
+    flat IP index — exact over a few thousand normalized vectors, ~1ms).
+    The lookup vector is the first active KB's query embedding, taken from
+    the request's QueryEmbeddingContext, so Stage 1 reuses it on a miss —
+    a cache lookup never costs an extra encode.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds=ANSWER_CACHE_TTL_SECONDS, min_cosine=ANSWER_CACHE_MIN_COSINE):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.min_cosine = min_cosine
+        self._entries = OrderedDict()   # entry id -> {"scope", "response", "created"}
+        self._indexes = {}              # scope -> faiss.IndexIDMap2
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def scope_for(active_kbs, rag_engines) -> tuple:
+        return tuple(
+            (kb_key, str(rag_engines[kb_key].meta_file_path))
+            for kb_key in active_kbs if kb_key in rag_engines
+        )
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        index = self._indexes[entry["scope"]]
+        index.remove_ids(np.array([entry_id], dtype=np.int64))
+        if index.ntotal == 0:
+            del self._indexes[entry["scope"]]
+
+    def lookup(self, scope, query_emb):
+        """
+        Returns a deep copy of the closest live cached response, or None.
+        Counts hits/misses.
+
+        Searches ANSWER_CACHE_SEARCH_K neighbours rather than one: if the
+        nearest entry has expired, a slightly less similar live entry still
+        above min_cosine is a hit, not a miss. Expired entries met on the way
+        are removed. The copy is deep so a caller mutating nested fields
+        (sources, scores) cannot corrupt the stored answer.
+        """
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(1, -1)
+        query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-12)
+
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None or index.d != query_emb.shape[1]:
+                self.counters["misses"] += 1
+                return None
+
+            sims, ids = index.search(query_emb, min(ANSWER_CACHE_SEARCH_K, index.ntotal))
+            now = time.monotonic()
+            for entry_id, sim in zip(ids[0].tolist(), sims[0].tolist()):
+                if entry_id < 0 or sim < self.min_cosine:
+                    break   # results are sorted — nothing further can match
+
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self.counters["expirations"] += 1
+                    continue
+
+                self._entries.move_to_end(entry_id)   # LRU touch
+                self.counters["hits"] += 1
+                return copy.deepcopy(entry["response"]) | {"cache_hit": True, "cache_similarity": sim}
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, scope, query_emb, response: dict):
+        if not scope or response.get("source_type") in UNCACHEABLE_SOURCE_TYPES:
+            return
+        if response.get("failed_kbs"):
+            return   # partial retrieval — don't replay a degraded answer
+
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(1, -1)
+        query_emb = query_emb / (np.linalg.norm(query_emb) + 1e-12)
+
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(query_emb.shape[1]))
+                self._indexes[scope] = index
+
+            entry_id = self._next_id
+            self._next_id += 1
+            index.add_with_ids(query_emb, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                "scope": scope,
+                "response": copy.deepcopy(response),
+                "created": time.monotonic()
+            }
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))   # least recently used
+                self.counters["evictions"] += 1
+
+    def invalidate_kb(self, kb_key):
+        """Drops every entry whose scope includes kb_key — used by /api/kb/unload."""
+        with self._lock:
+            stale = [eid for eid, e in self._entries.items()
+                     if any(k == kb_key for k, _ in e["scope"])]
+            for entry_id in stale:
+                self._remove(entry_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return dict(self.counters) | {
+                "entries": len(self._entries),
+                "scopes": len(self._indexes),
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+            }
+
+
+ANSWER_CACHE = SemanticAnswerCache()
+
+
+def cached_query_pipeline(query_text, active_kbs, rag_engines, rerankers, cache=ANSWER_CACHE):
+    """
+    process_query_pipeline with the semantic cache in front.
+    On a miss the same QueryEmbeddingContext is handed to the pipeline, so
+    the vector used for the lookup is the one Stage 1 searches with.
+    """
+    scope = cache.scope_for(active_kbs, rag_engines)
+    if not scope:
+        return process_query_pipeline(query_text, active_kbs, rag_engines, rerankers)
+
+    emb_ctx = QueryEmbeddingContext(query_text)
+    lookup_engine = rag_engines[scope[0][0]]
+    query_emb = emb_ctx.query_embedding(lookup_engine)
+
+    cached = cache.lookup(scope, query_emb)
+    if cached is not None:
+        return cached | {"query": query_text}
+
+    response = process_query_pipeline(query_text, active_kbs, rag_engines, rerankers, emb_ctx=emb_ctx)
+    cache.store(scope, query_emb, response)
+    return response | {"cache_hit": False}
+
+
+# GET /api/cache/stats  →  jsonify(ANSWER_CACHE.stats())
@@ -0,0 +1,128 @@
+# Demonstrates: Process-wide, reference-counted embedder registry.
+# Every KB built with the same model used to load its own 400-500MB copy.
+# The registry keys models by resolved path, hands out one shared
+# SentenceTransformer + LocalReranker, and frees them when the last KB unloads.
+# Part of ask_ai.py. Not standalone.
+
+class EmbedderRegistry:
+    """
+    One entry per (resolved model path, embedding backend):
+        {"embedder", "reranker", "dim", "refcount", "kbs", "resident_bytes"}
+
+    Keyed by the resolved path rather than the metadata model name, so two
+    names pointing at the same directory (symlinks, relative MODELS_ROOT)
+    still share one instance. The backend is part of the key — an fp32 KB
+    and an int8 KB on the same model each get the encoder they were built with.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, model_path: Path, kb_name: str, backend: str = "fp32") -> dict:
+        """
+        Returns the shared entry for model_path, loading it on first use.
+
+        The load happens under the registry lock — two KBs requesting the same
+        model at the same moment wait on one load instead of racing two.
+        The "test" encode that measures output dimension runs once per model,
+        not once per KB.
+        """
+        key = (str(Path(model_path).resolve()), backend)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                embedder = load_embedder(key[0], backend)
+                entry = {
+                    "embedder": embedder,
+                    "reranker": LocalReranker(embedder),
+                    "dim": embedder.encode(["test"], convert_to_numpy=True).shape[1],
+                    "refcount": 0,
+                    "kbs": set(),
+                    "resident_bytes": self._model_bytes(embedder)
+                }
+                self._entries[key] = entry
+
+            if kb_name not in entry["kbs"]:
+                entry["kbs"].add(kb_name)
+                entry["refcount"] += 1
+
+            return entry
+
+    def release(self, model_path: Path, kb_name: str, backend: str = "fp32") -> bool:
+        """
+        Drops kb_name's reference. When the count reaches zero the entry is
+        removed and the model freed. Returns True if the model was freed.
+        Releasing an unknown model or KB is a no-op, so unload is idempotent.
+        """
+        key = (str(Path(model_path).resolve()), backend)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or kb_name not in entry["kbs"]:
+                return False
+
+            entry["kbs"].discard(kb_name)
+            entry["refcount"] -= 1
+            if entry["refcount"] > 0:
+                return False
+
+            del self._entries[key]
+
+        # Outside the lock — gc on a 500MB model can take a moment
+        entry.clear()
+        gc.collect()
+        return True
+
+    def memory_report(self) -> list:
+        """
+        Per-model resident memory, largest first. resident_bytes is the model's
+        tensor storage (see _model_bytes) — the part that is duplicated when a model is loaded
+        twice — measured once at load time.
+        """
+        with self._lock:
+            report = [
+                {
+                    "model_path": key[0],
+                    "backend": key[1],
+                    "resident_mb": round(entry["resident_bytes"] / (1024 * 1024), 1),
+                    "refcount": entry["refcount"],
+                    "kbs": sorted(entry["kbs"])
+                }
+                for key, entry in self._entries.items()
+            ]
+        return sorted(report, key=lambda r: r["resident_mb"], reverse=True)
+
+    @staticmethod
+    def _model_bytes(embedder) -> int:
+        """
+        Tensor storage reachable from state_dict(). parameters() alone misses
+        int8_dynamic models: quantized Linear weights live in packed params,
+        which state_dict() exposes as (weight, bias) tuples. Tied tensors are
+        counted once. An onnx backend keeps its weights in the ONNX Runtime
+        session, outside torch, and reports 0.
+        """
+        seen, total = set(), 0
+        stack = list(embedder.state_dict(keep_vars=True).values())
+        while stack:
+            value = stack.pop()
+            if isinstance(value, (tuple, list)):
+                stack.extend(value)
+            elif hasattr(value, "element_size") and value.data_ptr() not in seen:
+                seen.add(value.data_ptr())
+                total += value.numel() * value.element_size()
+        return total
+
+
+EMBEDDER_REGISTRY = EmbedderRegistry()
+
+
+def rerankers_for(rag_engines: dict) -> dict:
+    """
+    The pipeline's rerankers map: embedding_key -> shared LocalReranker.
+    Keyed by (model, backend) like the registry, so results from an int8 KB
+    are never reranked with its fp32 sibling's vectors. Rebuilt after every
+    /api/kb/load and /api/kb/unload.
+    """
+    return {embedding_key(engine): engine.reranker for engine in rag_engines.values()}
@@ -0,0 +1,259 @@
+# Demonstrates: Selectable approximate FAISS index types with measured recall.
+# IndexFlatL2 is exact but scans every vector; past ~100k vectors IVF or HNSW
+# search is far faster. Each build records the index type and parameters in
+# the metadata blob and measures recall@k against exact search, so the
+# accuracy/latency trade-off is a number, not a guess.
+# Part of merge_vector.py (build) and ask_ai.py (load). Not standalone.
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Vector storage for flat, ivf_flat and hnsw: FAISS scalar-quantizer codes.
+# mode -> (factory suffix, bytes per dimension). ivf_pq is already compressed.
+VECTOR_STORAGE = {
+    "fp32": ("Flat", 4),
+    "fp16": ("SQfp16", 2),     # ~half the RAM/disk, near-lossless
+    "sq8":  ("SQ8", 1),        # per-dimension 8-bit, trained min/max — ~quarter
+}
+
+DEFAULT_INDEX_PARAMS = {
+    "storage": "fp32",       # "fp32", "fp16" or "sq8" — see VECTOR_STORAGE
+    "seed": 1234,            # k-means / PQ training seed — same input, same index
+    "nlist": None,           # IVF cells; None → 4·√n, clamped to [16, 65536] and to n / 39
+    "nprobe": 16,            # IVF cells visited per query
+    "pq_m": 64,              # PQ sub-quantizers (must divide embedding dim)
+    "pq_nbits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 128,
+    "train_size": 100_000,   # max training rows sampled for IVF/PQ
+    "recall_k": 10,
+    "recall_sample": 500,    # indexed rows reused as recall queries
+}
+
+MIN_POINTS_PER_CENTROID = 39   # FAISS k-means needs this many training rows per centroid
+
+
+def _check_training_size(index_type: str, params: dict, n_train: int):
+    """
+    Rejects builds whose k-means would be starved before FAISS fails deep
+    inside train(): IVF needs 39 rows per cell, PQ 2**pq_nbits rows per
+    codebook. An auto-sized nlist has already been clamped to fit.
+    """
+    if index_type.startswith("ivf") and n_train < MIN_POINTS_PER_CENTROID * params["nlist"]:
+        raise ValueError(
+            f"{index_type} with nlist={params['nlist']} needs ≥ {MIN_POINTS_PER_CENTROID * params['nlist']} "
+            f"training vectors, got {n_train} — lower nlist or leave it unset"
+        )
+    if index_type == "ivf_pq" and n_train < 2 ** params["pq_nbits"]:
+        raise ValueError(
+            f"ivf_pq with pq_nbits={params['pq_nbits']} needs ≥ {2 ** params['pq_nbits']} "
+            f"training vectors, got {n_train} — lower pq_nbits or use ivf_flat / flat"
+        )
+
+
+def _factory_string(index_type: str, params: dict) -> str:
+    if params["storage"] not in VECTOR_STORAGE:
+        raise ValueError(f"Unknown storage '{params['storage']}' — expected one of {tuple(VECTOR_STORAGE)}")
+    codes = VECTOR_STORAGE[params["storage"]][0]
+
+    if index_type == "flat":
+        return codes
+    if index_type == "ivf_flat":
+        return f"IVF{params['nlist']},{codes}"
+    if index_type == "ivf_pq":
+        if params["storage"] != "fp32":
+            raise ValueError("ivf_pq already stores PQ codes — storage must be 'fp32'")
+        return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']},{codes}"
+    raise ValueError(f"Unknown index_type '{index_type}' — expected one of {INDEX_TYPES}")
+
+
+def apply_search_params(index, index_params: dict):
+    """
+    Query-time knobs recorded at build time: nprobe for IVF, efSearch for HNSW.
+    IVF indexes also get a direct map so reconstruct() works — the reranker
+    and consensus scoring read stored vectors back by FAISS id.
+    Used by ask_ai.py load_kb and the /api/topk loader.
+    """
+    if not index_params:
+        return index
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = int(index_params.get("nprobe", ivf.nprobe))
+        ivf.make_direct_map()
+
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = int(index_params.get("ef_search", base.hnsw.efSearch))
+
+    return index
+
+
+def index_vector_storage(index) -> str:
+    """
+    The storage mode an index actually holds — "fp16", "sq8" or "fp32"
+    (plain float or PQ). load_kb compares it with the declared vector_storage.
+    """
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        base = faiss.downcast_index(ivf)
+    qtype = getattr(getattr(base, "sq", None), "qtype", None)
+    return {faiss.ScalarQuantizer.QT_fp16: "fp16", faiss.ScalarQuantizer.QT_8bit: "sq8"}.get(qtype, "fp32")
+
+
+ADD_CHUNK = 8192   # rows per index.add / exact-search chunk — bounded RAM on memmaps
+
+
+def _rows(embeddings, row_ids) -> np.ndarray:
+    return np.ascontiguousarray(embeddings[row_ids], dtype=np.float32)
+
+
+def measure_recall(index, embeddings: np.ndarray, row_ids: np.ndarray, query_pos: np.ndarray, k: int) -> float:
+    """
+    recall@k of index against exact L2 search over the same vectors.
+
+    row_ids maps index position → embeddings row; query_pos are index
+    positions used as queries. Ground truth is brute force, computed chunk
+    by chunk and merged, so it works on a memory-mapped spill file without
+    materializing the corpus.
+    """
+    queries = _rows(embeddings, row_ids[query_pos])
+    best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_i = np.full((len(queries), k), -1, dtype=np.int64)
+
+    for start in range(0, len(row_ids), ADD_CHUNK):
+        chunk = faiss.IndexFlatL2(embeddings.shape[1])
+        chunk.add(_rows(embeddings, row_ids[start:start + ADD_CHUNK]))
+        d, i = chunk.search(queries, min(k, chunk.ntotal))
+        all_d = np.hstack([best_d, d])
+        all_i = np.hstack([best_i, i + start])
+        order = np.argsort(all_d, axis=1, kind="stable")[:, :k]
+        best_d = np.take_along_axis(all_d, order, axis=1)
+        best_i = np.take_along_axis(all_i, order, axis=1)
+
+    _, found = index.search(queries, k)
+
+    hits = sum(len(set(t[t >= 0]) & set(f[f >= 0])) for t, f in zip(best_i, found))
+    return hits / float(len(queries) * k)
+
+
+def measure_fidelity(index, embeddings: np.ndarray, row_ids: np.ndarray, sample_pos: np.ndarray) -> dict:
+    """
+    Cosine between stored (reconstructed) and original vectors — what the
+    reranker and rag_consensus_signal see when they read vectors back from
+    a compressed index instead of re-encoding.
+    """
+    original = _rows(embeddings, row_ids[sample_pos]).astype(np.float64)
+    stored = index.reconstruct_batch(sample_pos.astype(np.int64)).astype(np.float64)
+    cos = (original * stored).sum(axis=1) / (
+        np.linalg.norm(original, axis=1) * np.linalg.norm(stored, axis=1) + 1e-12
+    )
+    return {"mean_cosine": round(float(cos.mean()), 6), "min_cosine": round(float(cos.min()), 6)}
+
+
+def build_search_index(embeddings: np.ndarray, index_type: str = "flat",
+                       index_params: dict = None, keep: np.ndarray = None) -> tuple:
+    """
+    Builds the requested index over the kept embedding rows.
+    Returns (index, build_info) — build_info is merged into the metadata blob.
+
+    embeddings may be an in-memory array or the streaming path's memmap;
+    keep is an optional boolean mask (outliers excluded). Rows are added in
+    ADD_CHUNK slices, so only the index itself grows with the corpus.
+
+    Determinism:
+    - Training uses every kept row (a seeded sample of train_size when the
+      corpus is larger), and the IVF k-means and PQ codebook seeds are
+      pinned. Same embeddings → same centroids → same index.
+    - HNSW graph construction is order-sensitive under OpenMP, so HNSW adds
+      run single-threaded.
+
+    Training size:
+    - An unset nlist is clamped so every cell gets 39 training rows. An
+      explicit nlist, or a pq_nbits codebook, that the corpus cannot train
+      raises ValueError up front.
+
+    Recall:
+    - recall_sample query rows are drawn (seeded) from the indexed rows —
+      queries come from the indexed set in production too — and recall@k
+      is measured against exact search. A flat fp32 index reports 1.0
+      without measuring.
+
+    Storage (index_params["storage"]):
+    - fp16 / sq8 keep scalar-quantized codes instead of float32. Recall
+      loss is measured the same way, and vector_fidelity records how close
+      reconstructed vectors are to the originals — reconstruct() still
+      feeds reranking and consensus scoring.
+    """
+    params = dict(DEFAULT_INDEX_PARAMS) | dict(index_params or {})
+    row_ids = np.flatnonzero(keep) if keep is not None else np.arange(embeddings.shape[0])
+    n, d = len(row_ids), embeddings.shape[1]
+    rng = np.random.default_rng(params["seed"])
+
+    n_train = min(n, params["train_size"])
+    if params["nlist"] is None:
+        params["nlist"] = int(min(65536, max(16, 4 * np.sqrt(n))))
+        params["nlist"] = max(1, min(params["nlist"], n_train // MIN_POINTS_PER_CENTROID))
+    _check_training_size(index_type, params, n_train)
+
+    factory = _factory_string(index_type, params)
+    index = faiss.index_factory(d, factory, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf = faiss.downcast_index(ivf)
+            ivf.cp.seed = params["seed"]
+            if index_type == "ivf_pq":
+                ivf.pq.cp.seed = params["seed"]
+        train_pos = np.sort(rng.choice(n, size=n_train, replace=False)) if n_train < n else np.arange(n)
+        index.train(_rows(embeddings, row_ids[train_pos]))
+
+    threads = faiss.omp_get_max_threads()
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = params["ef_construction"]
+        faiss.omp_set_num_threads(1)
+    try:
+        for start in range(0, n, ADD_CHUNK):
+            index.add(_rows(embeddings, row_ids[start:start + ADD_CHUNK]))
+    finally:
+        faiss.omp_set_num_threads(threads)
+
+    apply_search_params(index, params)
+
+    # Recall sample: seeded draw from the indexed rows
+    k = min(params["recall_k"], n)
+    fidelity = None
+    if index_type == "flat" and params["storage"] == "fp32":
+        recall, sample_size = 1.0, 0
+    else:
+        sample_size = min(params["recall_sample"], n)
+        query_pos = np.sort(rng.choice(n, size=sample_size, replace=False))
+        recall = measure_recall(index, embeddings, row_ids, query_pos, k)
+        if params["storage"] != "fp32":
+            fidelity = measure_fidelity(index, embeddings, row_ids, query_pos)
+
+    recorded = {key: params[key] for key in ("seed", "nlist", "nprobe") if index_type.startswith("ivf")}
+    if index_type == "ivf_pq":
+        recorded |= {"pq_m": params["pq_m"], "pq_nbits": params["pq_nbits"]}
+    if index_type == "hnsw":
+        recorded |= {"hnsw_m": params["hnsw_m"], "ef_construction": params["ef_construction"],
+                     "ef_search": params["ef_search"]}
+
+    build_info = {
+        "index_type": index_type,
+        "index_factory": factory,
+        "index_params": recorded,
+        "vector_storage": params["storage"],
+        "recall_at_k": {"k": k, "recall": round(recall, 4), "sample": sample_size}
+    }
+    if index_type != "ivf_pq":
+        build_info["vector_bytes"] = d * VECTOR_STORAGE[params["storage"]][1]
+    if fidelity is not None:
+        build_info["vector_fidelity"] = fidelity
+    return index, build_info
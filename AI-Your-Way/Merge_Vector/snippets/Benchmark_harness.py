@@ -0,0 +1,270 @@
+# Demonstrates: Repeatable, offline benchmark harness for the vectorization service.
+# No numbers existed for docs/sec vs encode batch size and threads, outlier
+# pass time, index build time, or search latency vs index size. This harness
+# generates synthetic Phase 1 JSONL, swaps in a deterministic stub embedder,
+# runs each pipeline stage, writes machine-readable results, and fails the
+# run when a metric regresses past a threshold against a stored baseline.
+# Part of merge_vector.py (python merge_vector.py --bench). Not standalone.
+
+BENCH_DOC_COUNTS = (1_000, 10_000)        # corpus sizes for build / persist / topk
+BENCH_BATCH_SIZES = (16, 32, 64, 128)
+BENCH_THREADS = (1, 2, 4)                 # torch/faiss threads; swept only for a real encoder
+BENCH_TOPK_QUERIES = 200
+BENCH_TOP_K = 5
+BENCH_REPEATS = 3                         # median of N runs per measurement
+BENCH_REGRESSION_TOLERANCE = 0.20         # 20% worse than baseline fails the check
+BENCH_RESULTS_DIR = VAULT_DIR / "bench"   # result JSON and baseline; scratch data goes to a temp dir
+
+BENCH_CATEGORIES = ("Healthcare", "Finance", "Legal", "Engineering", "Education")
+BENCH_VOCAB = (
+    "patient billing code appendectomy revenue quarterly filing statute contract "
+    "torque tolerance curriculum assessment diagnosis invoice ledger clause appeal "
+    "bearing syllabus audit compliance procedure dosage margin precedent load"
+).split()
+
+
+def generate_phase1_jsonl(path, n_docs: int, seed: int = 0) -> Path:
+    """
+    Synthetic Phase 1 output with the real metadata schema: text, doc_id,
+    source, category, created_at, summary, total_tokens. Seeded — the same
+    (n_docs, seed) always writes the same file.
+    """
+    rng = np.random.default_rng(seed)
+    path = Path(path)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n_docs):
+            n_tokens = int(rng.integers(20, 400))
+            words = rng.choice(BENCH_VOCAB, size=n_tokens)
+            category = BENCH_CATEGORIES[i % len(BENCH_CATEGORIES)]
+            f.write(json.dumps({
+                "text": " ".join(words),
+                "doc_id": f"bench_{i:07d}",
+                "source": f"https://example.org/{category.lower()}/{i}",
+                "category": category,
+                "created_at": f"2025-01-{1 + i % 28:02d}T10:00:00",
+                "summary": " ".join(words[:12]),
+                "total_tokens": n_tokens
+            }) + "\n")
+    return path
+
+
+class StubEmbedder:
+    """
+    Offline stand-in for SentenceTransformer.encode: each token maps to a
+    fixed random vector (hash-seeded), a text is the mean of its tokens.
+    Deterministic, EMBEDDING_DIM wide, and its cost grows with token count
+    like a real encoder's. It is a single-threaded Python loop, so torch and
+    faiss thread counts do not change its speed.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, seed: int = 0):
+        self.dim = dim
+        rng = np.random.default_rng(seed)
+        self._table = rng.standard_normal((4096, dim)).astype(np.float32)
+
+    def encode(self, texts, convert_to_numpy: bool = True, batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for batch_start in range(0, len(texts), batch_size):
+            for i, text in enumerate(texts[batch_start:batch_start + batch_size], batch_start):
+                ids = [zlib.crc32(tok.encode("utf-8")) % len(self._table) for tok in text.split()] or [0]
+                out[i] = self._table[ids].mean(axis=0)
+        return out
+
+
+@contextmanager
+def bench_environment(embedder, vault_dir: Path):
+    """
+    Routes get_model() to the benchmark embedder and persistence to a
+    scratch vault, restoring both afterwards — the real model and the real
+    Phase2_KBs directory are never touched.
+
+    VECTORIZE_WORKERS is pinned to 1 for the duration: with a sharded pool,
+    get_encoder() would hand encoding to worker processes that load the real
+    model and never see the benchmark embedder.
+    """
+    saved_model = MODEL_CACHE.get("model")
+    saved_vault = globals()["VAULT_DIR"]
+    saved_workers = globals()["VECTORIZE_WORKERS"]
+    MODEL_CACHE["model"] = embedder
+    globals()["VAULT_DIR"] = Path(vault_dir)
+    globals()["VECTORIZE_WORKERS"] = 1
+    try:
+        yield
+    finally:
+        globals()["VECTORIZE_WORKERS"] = saved_workers
+        globals()["VAULT_DIR"] = saved_vault
+        if saved_model is None:
+            MODEL_CACHE.pop("model", None)
+        else:
+            MODEL_CACHE["model"] = saved_model
+
+
+def _median_time(fn, repeats: int = BENCH_REPEATS) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def _set_threads(n: int):
+    faiss.omp_set_num_threads(n)
+    try:
+        import torch
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+
+
+def run_benchmarks(embedder=None, doc_counts=BENCH_DOC_COUNTS, work_dir: Path = None) -> dict:
+    """
+    Runs every scenario and returns {"env": ..., "results": [...]}.
+
+    Each result is {"scenario", "params", "metric", "value", "unit"}; the
+    unit decides the regression direction ("docs/s", "qps" higher is
+    better; "s", "ms" lower is better).
+
+    Scenarios:
+        parse_jsonl          docs/s per corpus size
+        encode               docs/s per (batch_size, threads); the stub
+                             embedder ignores threads, so it runs threads=1 only
+        build_faiss_index    total, encode, outlier pass and index build s —
+                             each step timed inside build_faiss_index
+                             (timings=), median of BENCH_REPEATS builds
+        persist_artifacts    s and bytes written
+        topk                 p50 / p95 ms per query (encode + search + rows)
+    """
+    embedder = embedder or StubEmbedder()
+    thread_counts = (1,) if isinstance(embedder, StubEmbedder) else BENCH_THREADS
+    scratch = work_dir is None          # generated JSONL + artifacts deleted afterwards
+    work_dir = Path(work_dir or tempfile.mkdtemp(prefix="merge_vector_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    threads_before = faiss.omp_get_max_threads()
+    results = []
+
+    def record(scenario, params, metric, value, unit):
+        results.append({"scenario": scenario, "params": params, "metric": metric,
+                        "value": round(float(value), 6), "unit": unit})
+
+    try:
+        with bench_environment(embedder, work_dir):
+            for n_docs in doc_counts:
+                jsonl = generate_phase1_jsonl(work_dir / f"phase1_{n_docs}.jsonl", n_docs)
+                params = {"docs": n_docs}
+
+                seconds = _median_time(lambda: parse_jsonl(str(jsonl)))
+                record("parse_jsonl", params, "throughput", n_docs / seconds, "docs/s")
+                documents = parse_jsonl(str(jsonl))
+                texts = [text for text, _ in documents]
+
+                if n_docs == doc_counts[0]:
+                    for threads in thread_counts:
+                        _set_threads(threads)
+                        for batch_size in BENCH_BATCH_SIZES:
+                            seconds = _median_time(lambda: embedder.encode(texts, batch_size=batch_size))
+                            record("encode", {"docs": n_docs, "batch_size": batch_size, "threads": threads},
+                                   "throughput", n_docs / seconds, "docs/s")
+                    _set_threads(threads_before)
+
+                # Build: every step timed where it runs, never derived by subtraction
+                runs = []
+                for _ in range(BENCH_REPEATS):
+                    timings = {}
+                    start = time.perf_counter()
+                    index, kept, outliers_idx, build_info = build_faiss_index(documents, timings=timings)
+                    runs.append(timings | {"total": time.perf_counter() - start})
+                for metric in ("total", "encode", "outlier_pass", "index_build"):
+                    record("build_faiss_index", params, metric, np.median([run[metric] for run in runs]), "s")
+
+                start = time.perf_counter()
+                faiss_file, meta_file = persist_index_artifacts(index, kept, outliers_idx, build_info)
+                record("persist_artifacts", params, "total", time.perf_counter() - start, "s")
+                record("persist_artifacts", params, "bytes",
+                       Path(faiss_file).stat().st_size + Path(meta_file).stat().st_size, "bytes")
+
+                # /api/topk path without Flask: cached entry, encode, search, rows
+                entry = load_index_pair(faiss_file, meta_file)
+                queries = [" ".join(np.random.default_rng(q).choice(BENCH_VOCAB, size=8))
+                           for q in range(BENCH_TOPK_QUERIES)]
+                latencies = []
+                for query in queries:
+                    start = time.perf_counter()
+                    query_emb = get_model().encode([query], convert_to_numpy=True)
+                    _, ids = entry["index"].search(np.ascontiguousarray(query_emb, dtype=np.float32), BENCH_TOP_K)
+                    [dict(entry["rows"][int(i)]) for i in ids[0] if i >= 0]
+                    latencies.append((time.perf_counter() - start) * 1000)
+                record("topk", params | {"top_k": BENCH_TOP_K}, "p50", np.percentile(latencies, 50), "ms")
+                record("topk", params | {"top_k": BENCH_TOP_K}, "p95", np.percentile(latencies, 95), "ms")
+    finally:
+        _set_threads(threads_before)
+        if scratch:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "env": {
+            "created_at": datetime.utcnow().isoformat(),
+            "embedder": type(embedder).__name__,
+            "embedding_dim": EMBEDDING_DIM,
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "faiss": getattr(faiss, "__version__", "unknown"),
+        },
+        "results": results
+    }
+
+
+HIGHER_IS_BETTER = {"docs/s", "qps"}
+
+
+def _result_key(result: dict) -> tuple:
+    return result["scenario"], json.dumps(result["params"], sort_keys=True), result["metric"]
+
+
+def check_regressions(current: dict, baseline: dict,
+                      tolerance: float = BENCH_REGRESSION_TOLERANCE) -> list:
+    """
+    Compares every metric present in both runs. Returns one entry per
+    regression beyond tolerance — empty list means the check passed.
+    Byte counts are compared too: a storage change that bloats artifacts
+    is a regression.
+    """
+    base = {_result_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        prior = base.get(_result_key(result))
+        if prior is None or prior["value"] == 0:
+            continue
+        change = (result["value"] - prior["value"]) / prior["value"]
+        worse = -change if result["unit"] in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append({
+                "scenario": result["scenario"], "params": result["params"],
+                "metric": result["metric"], "unit": result["unit"],
+                "baseline": prior["value"], "current": result["value"],
+                "worse_by": round(worse, 4)
+            })
+    return regressions
+
+
+def write_bench_results(report: dict, results_dir: Path = BENCH_RESULTS_DIR) -> Path:
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    path = results_dir / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    path.write_text(json.dumps(report, indent=2))
+    return path
+
+
+# CLI entry in merge_vector.py:
+#
+#   if "--bench" in sys.argv:
+#       report = run_benchmarks()
+#       print(f"Results: {write_bench_results(report)}")
+#       baseline = BENCH_RESULTS_DIR / "baseline.json"
+#       if baseline.exists():
+#           regressions = check_regressions(report, json.loads(baseline.read_text()))
+#           for r in regressions:
+#               print(f"[REGRESSION] {r['scenario']} {r['params']} {r['metric']}: "
+#                     f"{r['baseline']} → {r['current']} {r['unit']}")
+#           sys.exit(1 if regressions else 0)
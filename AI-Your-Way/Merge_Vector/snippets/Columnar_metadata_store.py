@@ -0,0 +1,219 @@
+# Demonstrates: Memory-mapped columnar metadata store for versioned FAISS indexes.
+# The pickled meta_map made startup time and RSS scale with corpus size even
+# though a query only reads the top-k rows. This format keeps each field in
+# its own column, maps the file read-only, and materializes rows by FAISS id.
+# Writer is part of merge_vector.py; reader is shared with ask_ai.py. Not standalone.
+
+# File layout (.mmeta):
+#
+#   MAGIC                                  8 bytes
+#   column sections, each 8-byte aligned   text blob + offsets, string columns, int columns
+#   footer                                 UTF-8 JSON: blob fields + column table
+#   footer length                          8 bytes, little-endian uint64
+#   MAGIC                                  8 bytes
+#
+# The footer carries the same top-level fields as the legacy pickle blob
+# (embedding_model, embedding_dim, created_at, total_chunks, outliers_removed)
+# so validation code reads either format unchanged.
+
+COLUMNAR_META_MAGIC = b"MMETA001"
+COLUMNAR_META_EXT = "mmeta"
+
+# Phase 1 schema — one column per field preserved by parse_jsonl
+STRING_COLUMNS = ["doc_id", "source", "category", "created_at", "summary"]
+INT_COLUMNS = ["total_tokens"]
+# Any metadata key outside the schema — or a schema value whose type does not
+# fit its column — is kept as a per-row JSON string
+EXTRA_COLUMN = "extra"
+MISSING_KEY = "__missing__"    # in extra: schema keys the row did not have at all
+INT64_RANGE = (-2**63, 2**63 - 1)
+
+
+def _fits_column(name: str, value) -> bool:
+    """True if value round-trips through its schema column unchanged."""
+    if name in INT_COLUMNS:
+        return (isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+                and INT64_RANGE[0] <= value <= INT64_RANGE[1])
+    return isinstance(value, str)
+
+
+def _extra_json(meta: dict) -> str:
+    """
+    The row's extra column: keys outside the schema, schema values the
+    columns cannot hold exactly (3.7 tokens, an int doc_id, None), and the
+    schema keys that were absent. "" when every field fits its column.
+    """
+    schema = STRING_COLUMNS + INT_COLUMNS
+    extra = {k: v for k, v in meta.items() if k not in schema or not _fits_column(k, v)}
+    missing = [name for name in schema if name not in meta]
+    if missing:
+        extra[MISSING_KEY] = missing
+    return json.dumps(extra, sort_keys=True) if extra else ""
+
+
+def _pad_to_8(f):
+    pad = (-f.tell()) % 8
+    if pad:
+        f.write(b"\0" * pad)
+
+
+def _write_string_column(f, values) -> dict:
+    """
+    Writes one string column as a UTF-8 blob followed by int64 offsets (n+1).
+    Streams the blob — only the offsets array (8 bytes per row) is held.
+    """
+    _pad_to_8(f)
+    blob_start = f.tell()
+    offsets = [0]
+    for value in values:
+        data = value.encode("utf-8")
+        f.write(data)
+        offsets.append(offsets[-1] + len(data))
+
+    _pad_to_8(f)
+    offsets_start = f.tell()
+    f.write(np.asarray(offsets, dtype="<i8").tobytes())
+
+    return {"kind": "string", "blob": blob_start, "offsets": offsets_start}
+
+
+def write_columnar_meta(path: str, blob_fields: dict, documents: list) -> str:
+    """
+    Persists (text, metadata) pairs in the memory-mappable columnar format.
+
+    blob_fields are the top-level contract fields (embedding_model, embedding_dim,
+    created_at, total_chunks, outliers_removed, ...) and land in the footer.
+    Row i of every column corresponds to FAISS id i — the same ordering
+    persist_index_artifacts has always used for the pickled documents list.
+
+    Round-trips are lossless: a value goes into its typed column only if
+    _fits_column holds; otherwise the column stores "" / 0 and the value
+    goes to the extra column, which the reader applies on top.
+    """
+    columns = {}
+
+    with open(path, "wb") as f:
+        f.write(COLUMNAR_META_MAGIC)
+
+        columns["text"] = _write_string_column(f, (text for text, _ in documents))
+
+        for name in STRING_COLUMNS:
+            columns[name] = _write_string_column(f, (
+                meta[name] if _fits_column(name, meta.get(name)) else ""
+                for _, meta in documents
+            ))
+
+        for name in INT_COLUMNS:
+            _pad_to_8(f)
+            columns[name] = {"kind": "int64", "data": f.tell()}
+            f.write(np.asarray(
+                [int(meta[name]) if _fits_column(name, meta.get(name)) else 0
+                 for _, meta in documents], dtype="<i8"
+            ).tobytes())
+
+        columns[EXTRA_COLUMN] = _write_string_column(f, (_extra_json(meta) for _, meta in documents))
+
+        footer = json.dumps(
+            dict(blob_fields) | {"format": "columnar", "rows": len(documents), "columns": columns}
+        ).encode("utf-8")
+        f.write(footer)
+        f.write(struct.pack("<Q", len(footer)))
+        f.write(COLUMNAR_META_MAGIC)
+
+    return path
+
+
+class ColumnarMetaMap:
+    """
+    Read-only, memory-mapped view over a .mmeta file.
+
+    Behaves like the list of dicts load_kb used to build — len(meta) and
+    meta[faiss_id] both work — but rows are decoded only when indexed.
+    Opening a million-row KB touches the footer and nothing else; the OS
+    pages in only the column bytes that top-k lookups actually read.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._buf = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+        if bytes(self._buf[:8]) != COLUMNAR_META_MAGIC or bytes(self._buf[-8:]) != COLUMNAR_META_MAGIC:
+            raise RuntimeError(f"Not a columnar metadata file: {self.path}")
+
+        footer_len = struct.unpack("<Q", bytes(self._buf[-16:-8]))[0]
+        footer_start = len(self._buf) - 16 - footer_len
+        self.header = json.loads(bytes(self._buf[footer_start:footer_start + footer_len]))
+        self.rows = int(self.header["rows"])
+
+        self._strings = {}
+        self._ints = {}
+        for name, col in self.header["columns"].items():
+            if col["kind"] == "string":
+                offsets = np.frombuffer(self._buf, dtype="<i8", count=self.rows + 1, offset=col["offsets"])
+                self._strings[name] = (col["blob"], offsets)
+            elif col["kind"] == "int64":
+                self._ints[name] = np.frombuffer(self._buf, dtype="<i8", count=self.rows, offset=col["data"])
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _string(self, name: str, i: int) -> str:
+        blob, offsets = self._strings[name]
+        return bytes(self._buf[blob + offsets[i]:blob + offsets[i + 1]]).decode("utf-8")
+
+    def column(self, name: str):
+        """
+        Whole-column access for int columns (zero-copy view). A row whose
+        value did not fit the column reads 0 here; row access returns it exactly.
+        """
+        return self._ints[name]
+
+    def __getitem__(self, i: int) -> dict:
+        """Materializes one row in the legacy shape: dict(metadata) | {"text": text}."""
+        i = int(i)
+        if i < 0:
+            i += self.rows
+        if not 0 <= i < self.rows:
+            raise IndexError(f"row {i} out of range for {self.rows} rows")
+
+        row = {name: self._string(name, i) for name in STRING_COLUMNS if name in self._strings}
+        row.update({name: int(values[i]) for name, values in self._ints.items()})
+
+        extra = self._string(EXTRA_COLUMN, i) if EXTRA_COLUMN in self._strings else ""
+        if extra:
+            extra = json.loads(extra)
+            for name in extra.pop(MISSING_KEY, ()):
+                row.pop(name, None)
+            row.update(extra)
+
+        row["text"] = self._string("text", i)
+        return row
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield self[i]
+
+
+def open_meta_map(path) -> tuple:
+    """
+    Opens either metadata format and returns (header, rows).
+
+    header: dict with embedding_model, embedding_dim and the other blob fields
+    rows:   indexable by FAISS id, len() == number of documents
+
+    Legacy .pkl blobs are still accepted so every previously persisted
+    version stays loadable — they are unpickled and expanded in full, as before.
+    """
+    path = Path(path)
+
+    if path.suffix == f".{COLUMNAR_META_EXT}":
+        rows = ColumnarMetaMap(path)
+        return rows.header, rows
+
+    with open(path, "rb") as f:
+        meta_blob = pickle.load(f)
+
+    documents = meta_blob.get("documents", [])
+    header = {k: v for k, v in meta_blob.items() if k != "documents"}
+    rows = [dict(metadata) | {"text": text} for text, metadata in documents]
+    return header, rows
@@ -0,0 +1,174 @@
+# Demonstrates: Incremental vectorization with a persistent content-hash embedding cache.
+# Daily refreshes of a mostly-unchanged JSONL used to re-embed every chunk.
+# Vectors are now cached on disk keyed by (embedding_model, embedding_dim,
+# embedding_backend, sha256(text)); a re-run encodes only new or changed
+# chunks. Outlier detection and index construction still run over the
+# complete set, so the versioned index is the one a clean rebuild over the
+# same cached vectors produces — which is not bit-for-bit a cold rebuild,
+# see EmbeddingCache.encode. The blob records how much came from the cache.
+# Part of merge_vector.py. Not standalone.
+
+EMBED_CACHE_DIR = VAULT_DIR / "embedding_cache"
+EMBED_CACHE_ENCODE_BATCH = 256   # cache misses per model.encode call
+EMBED_CACHE_FORWARD_BATCH = 32   # texts per forward pass within that call — several per
+                                 # call, so a sharded encoder has batches to spread
+
+
+class EmbeddingCache:
+    """
+    Append-only on-disk vector store for one (model, dim, backend).
+
+    Two files per store, in EMBED_CACHE_DIR:
+        emb_cache_{model}_{dim}[_{backend}].keys — 32-byte sha256 digests, one per row
+        emb_cache_{model}_{dim}[_{backend}].f32  — raw float32 vectors, same row order
+    fp32 stores carry no backend suffix.
+
+    The digest → row map is the only thing held in RAM (~100 bytes per
+    cached chunk); vectors are read through a memory map.
+
+    Why the model, dimension AND backend are in the key:
+    A vector is only valid for the exact model that produced it. Switching
+    EMBEDDING_MODEL_NAME, EMBEDDING_DIM or EMBEDDING_BACKEND opens a
+    different file pair — a stale or int8 vector can never be served to a
+    different model or to an fp32 build.
+
+    Crash safety:
+    Vectors are written and flushed before their keys. On open, both files
+    are truncated to the row count they agree on, so an interrupted run
+    loses at most its unflushed tail — never a key pointing at a missing
+    or half-written vector.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, dim: int = EMBEDDING_DIM,
+                 backend: str = EMBEDDING_BACKEND, cache_dir: Path = EMBED_CACHE_DIR):
+        self.model_name = model_name
+        self.dim = dim
+        self.backend = backend
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        stem = f"emb_cache_{model_name.replace('/', '_')}_{dim}"
+        if backend != "fp32":
+            stem += f"_{backend}"
+        self.keys_path = cache_dir / f"{stem}.keys"
+        self.vecs_path = cache_dir / f"{stem}.f32"
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "encoded": 0}
+
+        self.keys_path.touch(exist_ok=True)
+        self.vecs_path.touch(exist_ok=True)
+        row_bytes = dim * 4
+        rows = min(self.keys_path.stat().st_size // 32, self.vecs_path.stat().st_size // row_bytes)
+        for path, size in ((self.keys_path, rows * 32), (self.vecs_path, rows * row_bytes)):
+            if path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+        keys = self.keys_path.read_bytes()
+        self._rows = {keys[i:i + 32]: i // 32 for i in range(0, len(keys), 32)}
+        self._vectors = None
+        self._remap()
+
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _remap(self):
+        n = len(self._rows)
+        self._vectors = (np.memmap(self.vecs_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+                         if n else np.empty((0, self.dim), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _append(self, keys: list, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise RuntimeError(
+                f"Embedding cache for '{self.model_name}' expects {self.dim}D, "
+                f"model produced {vectors.shape[1]}D"
+            )
+        with open(self.vecs_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys))
+        start = len(self._rows)
+        for offset, key in enumerate(keys):
+            self._rows[key] = start + offset
+        self._remap()
+
+    def encode(self, model, texts: list, batch_size: int = EMBED_CACHE_ENCODE_BATCH,
+               usage: dict = None, forward_batch_size: int = EMBED_CACHE_FORWARD_BATCH) -> np.ndarray:
+        """
+        Embeddings for texts, in input order — cached rows copied from disk,
+        misses encoded once each (duplicates within a run share one encode)
+        and appended to the cache.
+
+        Returns an (n, dim) float32 array for the caller's outlier pass and
+        index build.
+
+        What this does NOT guarantee: equality with a cold full encode.
+        Misses are encoded in batches of misses only, and a vector's last
+        bits depend on the padding of the batch it shared (see plan_batches).
+        Every cached row keeps the bits of the run that first encoded it, so
+        the vectors — and, for a point within rounding of the threshold, the
+        outlier set — depend on refresh history. Same cache files, same
+        input → same index; against a cold rebuild, equal within float
+        tolerance.
+
+        usage, if given, accumulates {"reused", "encoded"} for this caller
+        alone (the cache's own counters are shared by concurrent builds);
+        build_faiss_index records it in the blob as build_info["embedding_cache"].
+        """
+        keys = [self.text_key(t) for t in texts]
+
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+
+            miss_keys = list(missing)
+            for start in range(0, len(miss_keys), batch_size):
+                batch_keys = miss_keys[start:start + batch_size]
+                vectors = model.encode([missing[k] for k in batch_keys],
+                                       convert_to_numpy=True, batch_size=forward_batch_size)
+                self._append(batch_keys, vectors)
+
+            self.counters["encoded"] += len(miss_keys)
+            self.counters["hits"] += len(keys) - len(miss_keys)
+            if usage is not None:
+                usage["encoded"] = usage.get("encoded", 0) + len(miss_keys)
+                usage["reused"] = usage.get("reused", 0) + len(keys) - len(miss_keys)
+
+            rows = np.fromiter((self._rows[k] for k in keys), dtype=np.int64, count=len(keys))
+            return np.array(self._vectors[rows], dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters) | {"entries": len(self._rows), "model": self.model_name,
+                                        "dim": self.dim, "backend": self.backend}
+
+
+EMBEDDING_CACHE = {}   # (model_name, dim, backend) -> EmbeddingCache, opened on first use
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    key = (EMBEDDING_MODEL_NAME, EMBEDDING_DIM, EMBEDDING_BACKEND)
+    if key not in EMBEDDING_CACHE:
+        EMBEDDING_CACHE[key] = EmbeddingCache(*key)
+    return EMBEDDING_CACHE[key]
+
+
+# In the /api/vectorize endpoint (incremental=true, the default for refreshes):
+#
+#   cache = get_embedding_cache() if incremental else None
+#   index, documents, outliers_idx, build_info = build_faiss_index(
+#       documents, outlier_thresh, exclude_outliers, index_type=index_type,
+#       embedding_cache=cache
+#   )
+#   faiss_file, meta_file = persist_index_artifacts(index, documents, outliers_idx, build_info)
+#   if cache:
+#       response["embedding_cache"] = build_info["embedding_cache"]   # also in the meta blob
@@ -4,9 +4,11 @@
 # from the same input depending on processing sequence.
 # Part of merge_vector.py. Not standalone.
 
-def build_faiss_index(documents: list, outlier_thresh: float = 3.0, exclude_outliers: bool = True):
+def build_faiss_index(documents: list, outlier_thresh: float = 3.0, exclude_outliers: bool = True,
+                      index_type: str = "flat", index_params: dict = None,
+                      embedding_cache=None, dedup_threshold: float = None, timings: dict = None):
     """
-    Builds a FAISS IndexFlatL2 from document embeddings with statistical outlier removal.
+    Builds a FAISS index from document embeddings with statistical outlier removal.
 
     Why deterministic ordering matters:
     Outlier detection using running statistics changes which points are flagged
@@ -18,14 +20,51 @@ def build_faiss_index(documents: list, outlier_thresh: float = 3.0, exclude_outl
     A document is flagged if its distance from the centroid exceeds
     (outlier_thresh × std_norm). Default 3.0 follows the 3-sigma rule —
     retains 99.7% of a normal distribution, removes genuine outliers.
+
+    Index type:
+    "flat" (IndexFlatL2, exact) by default; "ivf_flat", "ivf_pq" or "hnsw"
+    for large KBs. Returns (index, documents, outliers_idx, build_info) —
+    build_info carries index type, parameters and measured recall@k into
+    the metadata blob.
+
+    Near-duplicates:
+    With dedup_threshold set, MinHash/LSH dedup runs before Step 1 — copies
+    are never embedded. outliers_idx then indexes the deduplicated list, and
+    build_info["duplicates_removed"] records how many were dropped.
+
+    Incremental runs:
+    With an EmbeddingCache, Step 1 encodes only chunks whose text hash is
+    not cached yet. Steps 2-5 are unchanged and always see the complete
+    set — a refresh yields the same outliers and index as a clean rebuild
+    over the same cached vectors. Cached vectors carry the batch padding of
+    the run that first encoded them, so against a cold rebuild the result
+    is equal only within float tolerance. build_info["embedding_cache"]
+    ({"reused", "encoded"}) records the cache's part in the blob.
+
+    Timings:
+    timings, if given, receives wall seconds for "encode" (Step 1),
+    "outlier_pass" (Steps 2-4) and "index_build" (Step 5), each measured
+    around the step itself — the benchmark harness records these.
     """
-    model = get_model()
+    model = get_encoder()   # get_model(), or the sharded pool when VECTORIZE_WORKERS > 1
+
+    # Step 0: Drop near-duplicate chunks before paying to embed them
+    duplicates_removed = 0
+    if dedup_threshold is not None:
+        documents, duplicates_removed = deduplicate_documents(documents, dedup_threshold)
+
     texts = [text for text, _ in documents]
 
     # Step 1: Compute ALL embeddings before any filtering (deterministic)
-    embeddings = model.encode(texts, convert_to_numpy=True)
+    encode_start = time.perf_counter()
+    cache_usage = {"reused": 0, "encoded": 0}
+    if embedding_cache is not None:
+        embeddings = embedding_cache.encode(model, texts, usage=cache_usage)
+    else:
+        embeddings = model.encode(texts, convert_to_numpy=True)
 
     # Step 2: Stable mean/std from the complete embedding set
+    outlier_start = time.perf_counter()
     mean = np.mean(embeddings, axis=0)
     std = np.std(embeddings, axis=0)
     std_norm = np.linalg.norm(std)
@@ -43,8 +82,17 @@ def build_faiss_index(documents: list, outlier_thresh: float = 3.0, exclude_outl
         embeddings = np.delete(embeddings, outliers_idx, axis=0)
         documents = [doc for idx, doc in enumerate(documents) if idx not in outliers_idx]
 
-    # Step 5: Build FAISS flat L2 index (exact search, best for <100k vectors)
-    index = faiss.IndexFlatL2(EMBEDDING_DIM)
-    index.add(embeddings)
+    # Step 5: Build FAISS index — flat L2 (exact, best for <100k vectors) unless
+    # an approximate type is requested; recall@k measured for approximate types
+    index_start = time.perf_counter()
+    index, build_info = build_search_index(embeddings, index_type, index_params)
+    if timings is not None:
+        timings.update(encode=outlier_start - encode_start,
+                       outlier_pass=index_start - outlier_start,
+                       index_build=time.perf_counter() - index_start)
+    if dedup_threshold is not None:
+        build_info["duplicates_removed"] = duplicates_removed
+    if embedding_cache is not None:
+        build_info["embedding_cache"] = cache_usage
 
-    return index, documents, outliers_idx
+    return index, documents, outliers_idx, build_info
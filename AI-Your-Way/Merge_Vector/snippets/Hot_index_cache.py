@@ -0,0 +1,245 @@
+# Demonstrates: Hot index cache with mmap loading and zero-downtime version swap.
+# /api/topk used to load the whole FAISS index and metadata on every request.
+# Loaded (index, metadata) pairs now live in an in-process LRU keyed by the
+# resolved file pair and bounded by resident bytes. Large flat indexes are
+# memory-mapped instead of read into the heap. A watcher promotes each newly
+# persisted version once it passes topk_search_validation.
+# Part of merge_vector.py /api/topk endpoint. Not standalone.
+
+INDEX_CACHE_MAX_BYTES = 4 * 1024**3     # heap-resident budget across cached versions
+INDEX_CACHE_MAX_ENTRIES = 8             # bounds open mappings for mmap-backed entries
+MMAP_MIN_BYTES = 256 * 1024**2          # flat indexes at least this large are mmap'd
+INDEX_WATCH_INTERVAL = 5.0              # seconds between VAULT_DIR polls
+
+# Flat-code mmap flag (FAISS ≥ 1.9); older builds fall back to the IVF mmap flag
+FAISS_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def index_pair_key(faiss_file, meta_file) -> tuple:
+    """
+    Cache identity of a pair: both paths resolved. Two vaults (or a request
+    naming a different metadata file) can share a versioned faiss filename;
+    the basename alone would serve one pair's rows for the other's index.
+    """
+    return str(Path(faiss_file).resolve()), str(Path(meta_file).resolve())
+
+
+def load_index_pair(faiss_file, meta_file) -> dict:
+    """
+    Opens one versioned (index, metadata) pair.
+
+    Metadata first — its index_type decides how the index is opened:
+    flat indexes of MMAP_MIN_BYTES or more are memory-mapped read-only, so
+    the OS page cache holds the vectors and RSS stays flat. Approximate
+    indexes are read normally (apply_search_params may build a direct map,
+    which needs a writable index).
+
+    resident_bytes is what the entry costs the heap: 0 for memory-mapped
+    artifacts (columnar .mmeta, mmap'd index), file size otherwise.
+    """
+    faiss_file, meta_file = Path(faiss_file), Path(meta_file)
+    meta_blob, rows = open_meta_map(meta_file)
+
+    index_bytes = faiss_file.stat().st_size
+    mmapped = meta_blob.get("index_type", "flat") == "flat" and index_bytes >= MMAP_MIN_BYTES
+    if mmapped:
+        index = faiss.read_index(str(faiss_file), FAISS_MMAP_FLAGS)
+    else:
+        index = faiss.read_index(str(faiss_file))
+        apply_search_params(index, meta_blob.get("index_params"))
+
+    if len(rows) != index.ntotal:
+        raise RuntimeError(
+            f"FAISS/meta size mismatch for {faiss_file.name}: "
+            f"{index.ntotal} vectors vs {len(rows)} documents"
+        )
+
+    resident = (0 if mmapped else index_bytes) + \
+               (0 if meta_file.suffix == f".{COLUMNAR_META_EXT}" else meta_file.stat().st_size)
+
+    return {
+        "key": index_pair_key(faiss_file, meta_file),
+        "version": faiss_file.name,      # timestamped name — orders versions for promotion
+        "faiss_file": str(faiss_file),
+        "meta_file": str(meta_file),
+        "index": index,
+        "meta_blob": meta_blob,
+        "rows": rows,
+        "mmapped": mmapped,
+        "resident_bytes": resident,
+    }
+
+
+def latest_artifact_pair(vault_dir: Path = VAULT_DIR):
+    """Newest faiss_index_*.bin that has a meta_map with the same version suffix."""
+    for faiss_file in sorted(Path(vault_dir).glob("faiss_index_*.bin"), reverse=True):
+        suffix = faiss_file.stem[len("faiss_index_"):]
+        for ext in (COLUMNAR_META_EXT, "pkl"):
+            meta_file = faiss_file.with_name(f"meta_map_{suffix}.{ext}")
+            if meta_file.exists():
+                return faiss_file, meta_file
+    return None
+
+
+class HotIndexCache:
+    """
+    LRU of loaded index pairs, keyed by index_pair_key (resolved faiss and
+    meta paths). Promotion compares entries by "version", the filename.
+
+    Entries are never mutated after load. A query takes a reference to its
+    entry and searches that — eviction or a version swap only drops the
+    cache's reference, so in-flight queries finish on the version they
+    started with and the old index is freed when the last one returns.
+
+    Loads happen outside the cache lock, with a per-key lock so concurrent
+    first requests for the same version load it once.
+    """
+
+    def __init__(self, max_bytes=INDEX_CACHE_MAX_BYTES, max_entries=INDEX_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._resident = 0
+        self._current = None
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.counters = {"hits": 0, "loads": 0, "evictions": 0, "swaps": 0, "rejected": 0}
+
+    def _insert_locked(self, entry: dict):
+        """Adds entry and evicts down to the limits. Caller holds self._lock."""
+        if entry["key"] in self._entries:
+            return self._entries[entry["key"]]
+        self._entries[entry["key"]] = entry
+        self._resident += entry["resident_bytes"]
+        current_key = self._current["key"] if self._current else None
+        # Evict least recently used, never the version currently served
+        for key in list(self._entries):
+            if self._resident <= self.max_bytes and len(self._entries) <= self.max_entries:
+                break
+            if key in (current_key, entry["key"]):
+                continue
+            self._resident -= self._entries.pop(key)["resident_bytes"]
+            self.counters["evictions"] += 1
+        return entry
+
+    def get(self, faiss_file, meta_file) -> dict:
+        key = index_pair_key(faiss_file, meta_file)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.counters["hits"] += 1
+                    return self._entries[key]
+            entry = load_index_pair(faiss_file, meta_file)
+            # Insert and drop the load lock in one critical section: a request
+            # arriving in between would find neither and load the pair again
+            with self._lock:
+                self.counters["loads"] += 1
+                entry = self._insert_locked(entry)
+                self._load_locks.pop(key, None)
+            return entry
+
+    def current(self) -> dict:
+        """The version /api/topk serves when the request names no files."""
+        with self._lock:
+            return self._current
+
+    def promote(self, faiss_file, meta_file) -> bool:
+        """
+        Loads a version, validates it, and makes it current in one
+        reference assignment. A version failing topk_search_validation is
+        left cached but never served by default.
+        """
+        entry = self.get(faiss_file, meta_file)
+        valid, error_body, _ = topk_search_validation(entry["meta_blob"])
+        if not valid:
+            with self._lock:
+                self.counters["rejected"] += 1
+            print(f"[WARN] Not promoting {entry['version']}: {error_body['message']}")
+            return False
+        with self._lock:
+            if self._current is None or entry["version"] > self._current["version"]:
+                self._current = entry
+                self.counters["swaps"] += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters) | {
+                "entries": len(self._entries),
+                "resident_bytes": self._resident,
+                "current": self._current["version"] if self._current else None
+            }
+
+
+class IndexWatcher(threading.Thread):
+    """
+    Polls VAULT_DIR and promotes the newest complete artifact pair.
+
+    persist_index_artifacts writes the index before its metadata, and the
+    columnar writer's footer lands last — a pair whose metadata is still
+    being written fails to open and is simply retried on the next poll.
+    Versions that fail validation are remembered and not reloaded.
+    """
+
+    def __init__(self, cache: HotIndexCache, vault_dir: Path = VAULT_DIR,
+                 interval: float = INDEX_WATCH_INTERVAL):
+        super().__init__(daemon=True, name="index-watcher")
+        self.cache = cache
+        self.vault_dir = vault_dir
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._rejected = set()
+
+    def poll_once(self):
+        pair = latest_artifact_pair(self.vault_dir)
+        if pair is None or pair[0].name in self._rejected:
+            return
+        current = self.cache.current()
+        if current is not None and current["version"] >= pair[0].name:
+            return
+        try:
+            if not self.cache.promote(*pair):
+                self._rejected.add(pair[0].name)
+        except Exception as e:
+            print(f"[WARN] Index watcher: {pair[0].name} not ready: {e}")
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.poll_once()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+INDEX_CACHE = HotIndexCache()
+
+
+# At startup:
+#
+#   watcher = IndexWatcher(INDEX_CACHE)
+#   watcher.poll_once()        # serve the newest valid version immediately
+#   watcher.start()
+#
+# In the /api/topk endpoint:
+#
+#   if data.get("faiss_index") and data.get("meta_map"):
+#       entry = INDEX_CACHE.get(data["faiss_index"], data["meta_map"])
+#   else:
+#       entry = INDEX_CACHE.current()      # latest promoted version
+#   if entry is None:
+#       return jsonify({"status": "error", "message": "No index loaded"}), 503
+#   valid, error_body, status_code = topk_search_validation(entry["meta_blob"])
+#   if not valid:
+#       return jsonify(error_body), status_code
+#   query_emb = get_model(backend_of(entry["meta_blob"])).encode([query], convert_to_numpy=True)
+#   distances, ids = entry["index"].search(query_emb, top_k)   # this entry, even if a swap lands mid-query
+#   results = [dict(entry["rows"][int(i)]) for i in ids[0] if i >= 0]
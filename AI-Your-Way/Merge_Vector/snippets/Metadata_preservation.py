@@ -4,6 +4,47 @@
 # results include source, category, summary, and token counts — not just text.
 # Part of merge_vector.py. Not standalone.
 
+def iter_jsonl(path_or_file):
+    """
+    Lazily yields (text, metadata) tuples from Phase 1 JSONL, one line at a time.
+
+    Same field handling as parse_jsonl — which is now just list(iter_jsonl(...)) —
+    but never holds more than one line in memory. Uploaded files (FileStorage)
+    are read through their underlying binary stream with an incremental
+    UTF-8 decoder instead of .read().decode().
+    """
+    if hasattr(path_or_file, "read"):
+        stream = getattr(path_or_file, "stream", path_or_file)
+        f = io.TextIOWrapper(stream, encoding="utf-8")
+        close = False
+    else:
+        f = open(path_or_file, "r", encoding="utf-8")
+        close = True
+
+    try:
+        for line_no, line in enumerate(f, 1):
+            try:
+                j = json.loads(line)
+                text = j.get("text", "").strip()
+                if text:
+                    metadata = {
+                        "doc_id":       j.get("doc_id", ""),
+                        "source":       j.get("source", ""),
+                        "category":     j.get("category", "General"),
+                        "created_at":   j.get("created_at", ""),
+                        "summary":      j.get("summary", ""),       # Phase 1 parser brain output
+                        "total_tokens": j.get("total_tokens", 0)    # Phase 1 token estimate
+                    }
+                    yield text, metadata
+            except Exception as e:
+                print(f"[WARN] Skipping invalid JSON line {line_no}: {e}")  # skip, don't crash
+    finally:
+        if close:
+            f.close()
+        else:
+            f.detach()   # leave the caller's upload stream open
+
+
 def parse_jsonl(path_or_file) -> list:
     """
     Parses Phase 1 JSONL output into (text, metadata) tuples.
@@ -23,30 +64,8 @@ def parse_jsonl(path_or_file) -> list:
     Early versions dropped these fields — retrieval results had no context
     about what the document contained or how large it was.
     Invalid JSON lines are skipped with a warning, not a fatal error.
-    """
-    documents = []
 
-    if hasattr(path_or_file, "read"):
-        lines = path_or_file.read().decode("utf-8").splitlines()
-    else:
-        with open(path_or_file, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-    for line_no, line in enumerate(lines, 1):
-        try:
-            j = json.loads(line)
-            text = j.get("text", "").strip()
-            if text:
-                metadata = {
-                    "doc_id":       j.get("doc_id", ""),
-                    "source":       j.get("source", ""),
-                    "category":     j.get("category", "General"),
-                    "created_at":   j.get("created_at", ""),
-                    "summary":      j.get("summary", ""),       # Phase 1 parser brain output
-                    "total_tokens": j.get("total_tokens", 0)    # Phase 1 token estimate
-                }
-                documents.append((text, metadata))
-        except Exception as e:
-            print(f"[WARN] Skipping invalid JSON line {line_no}: {e}")  # skip, don't crash
-
-    return documents
+    Materializes the whole file. Large corpora should go through iter_jsonl
+    and the streaming vectorizer instead.
+    """
+    return list(iter_jsonl(path_or_file))
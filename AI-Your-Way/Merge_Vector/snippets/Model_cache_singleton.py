@@ -2,6 +2,8 @@
 # SentenceTransformer models are 400-500MB and take 2-8 seconds to load.
 # Loading on first request instead of at startup means the Flask server
 # is immediately available — health checks pass before the model is warm.
+# Optional background preload + a readiness endpoint keep the load balancer
+# from routing traffic into that first-request stall.
 # Part of merge_vector.py. Not standalone.
 
 # Single approved model — locked at config level, not per-request
@@ -9,12 +11,29 @@ EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
 EMBEDDING_MODEL_PATH = os.path.join(LOCAL_MODEL_DIR, EMBEDDING_MODEL_NAME)
 EMBEDDING_DIM = 768
 
+MODEL_PRELOAD = False          # opt-in: start loading in a background thread at startup
+MODEL_LOAD_TIMEOUT = 60.0      # seconds a request waits on an in-progress load
+MODEL_PRELOAD_RETRY_DELAY = 2.0        # first retry after a failed preload; doubles each attempt
+MODEL_PRELOAD_RETRY_MAX_DELAY = 60.0   # backoff cap — the preload thread retries until it succeeds
+WARMUP_TEXTS = ["warm-up", "A short sentence to initialize allocator and kernels."]
+
 MODEL_CACHE = {}
+MODEL_STATE = {"status": "cold", "error": None, "load_seconds": None,   # cold | loading | warm | failed
+               "workers": "cold",        # sharded pool (VECTORIZE_WORKERS > 1): cold | warming | warm | failed
+               "preload_attempts": 0}
+_MODEL_LOCK = threading.Lock()
+
 
-def get_model() -> SentenceTransformer:
+def get_model(backend: str = None) -> SentenceTransformer:
     """
     Loads the embedding model on first call and caches it for the process lifetime.
 
+    backend (fp32, int8_dynamic, onnx) defaults to EMBEDDING_BACKEND, the one
+    new KBs are built with. /api/topk passes the backend recorded in the KB's
+    blob instead, so a KB keeps being queried with the encoder that built it
+    after the default changes. Each backend is loaded once, on first use;
+    MODEL_STATE and readiness track the default one.
+
     Why lazy loading instead of loading at module import:
     - Flask server is immediately available (health checks pass before model loads)
     - Startup errors in the model load don't kill the entire process silently
@@ -25,12 +44,122 @@ def get_model() -> SentenceTransformer:
     - Dict cache is explicit — MODEL_CACHE["model"] is inspectable in debug sessions
     - Supports future multi-model expansion (MODEL_CACHE["other_model"])
 
+    Why a lock around the load:
+    Several requests arriving during startup (or during the preload thread's
+    load) would otherwise each construct a 500MB model. The first caller
+    loads; the rest block on _MODEL_LOCK for up to MODEL_LOAD_TIMEOUT and
+    then take the cached instance. The warm cache hit never touches the lock.
+
+    A load includes one warm-up encode, so the first real request doesn't
+    pay for allocator growth and kernel initialization either.
+
     Raises RuntimeError with the underlying cause — callers get a clear message
     instead of an AttributeError on None two stack frames later.
     """
-    if "model" not in MODEL_CACHE:
-        try:
-            MODEL_CACHE["model"] = SentenceTransformer(EMBEDDING_MODEL_PATH)
-        except Exception as e:
-            raise RuntimeError(f"Failed to load embedding model from {EMBEDDING_MODEL_PATH}: {e}")
-    return MODEL_CACHE["model"]
+    backend = backend or EMBEDDING_BACKEND
+    key = "model" if backend == EMBEDDING_BACKEND else f"model:{backend}"
+    if key in MODEL_CACHE:
+        return MODEL_CACHE[key]
+
+    if not _MODEL_LOCK.acquire(timeout=MODEL_LOAD_TIMEOUT):
+        raise RuntimeError(f"Embedding model still loading after {MODEL_LOAD_TIMEOUT:.0f}s")
+    try:
+        if key not in MODEL_CACHE:
+            is_default = key == "model"
+            if is_default:
+                MODEL_STATE.update(status="loading", error=None)
+            start = time.perf_counter()
+            try:
+                model = load_embedder(EMBEDDING_MODEL_PATH, backend)
+                model.encode(WARMUP_TEXTS, convert_to_numpy=True)
+            except Exception as e:
+                if is_default:
+                    MODEL_STATE.update(status="failed", error=str(e), load_seconds=None)
+                raise RuntimeError(f"Failed to load embedding model ({backend}) from {EMBEDDING_MODEL_PATH}: {e}")
+            MODEL_CACHE[key] = model
+            if is_default:
+                MODEL_STATE.update(status="warm", load_seconds=round(time.perf_counter() - start, 3))
+    finally:
+        _MODEL_LOCK.release()
+    return MODEL_CACHE[key]
+
+
+def _warm_workers():
+    """
+    Starts and warms the sharded pool. A failure is recorded as
+    workers="failed" — the model itself may be warm — and the broken pool is
+    dropped from MODEL_CACHE so the next attempt spawns a fresh one.
+    """
+    MODEL_STATE["workers"] = "warming"
+    try:
+        get_encoder().warm_up()
+    except Exception as e:
+        MODEL_STATE.update(workers="failed", error=f"Sharded worker warm-up failed: {e}")
+        encoder = MODEL_CACHE.pop("sharded", None)
+        if encoder is not None:
+            encoder.shutdown()
+        raise
+    MODEL_STATE.update(workers="warm", error=None)
+
+
+def preload_model_async():
+    """
+    Starts the load in a daemon thread. Requests that arrive meanwhile wait
+    on the same lock rather than starting a second load.
+
+    With VECTORIZE_WORKERS > 1 the sharded pool is started and warmed too —
+    each worker process loads its own model copy, and without this the
+    first /api/vectorize would pay for all of them.
+
+    Why the thread retries instead of leaving it to the next request:
+    A not-ready instance gets no traffic, so no request would ever arrive to
+    retry. Failures are recorded in MODEL_STATE (status or workers "failed",
+    /api/ready answers 503) and retried with exponential backoff, from
+    MODEL_PRELOAD_RETRY_DELAY up to MODEL_PRELOAD_RETRY_MAX_DELAY, until the
+    model and workers are warm — a transient failure (disk, OOM while another
+    process exits) recovers without a restart.
+    """
+    def _load():
+        delay = MODEL_PRELOAD_RETRY_DELAY
+        while True:
+            MODEL_STATE["preload_attempts"] += 1
+            try:
+                get_model()
+                if VECTORIZE_WORKERS > 1:
+                    _warm_workers()
+                return
+            except Exception as e:
+                print(f"[WARN] Model preload attempt {MODEL_STATE['preload_attempts']} failed: {e} "
+                      f"— retrying in {delay:.0f}s")
+            time.sleep(delay)
+            delay = min(delay * 2, MODEL_PRELOAD_RETRY_MAX_DELAY)
+
+    threading.Thread(target=_load, daemon=True, name="model-preload").start()
+
+
+def model_ready() -> bool:
+    """
+    Readiness for /api/ready.
+
+    Without MODEL_PRELOAD the model loads on the first request by design,
+    so the instance is ready as soon as it is up — gating on "warm" would
+    wait for a load that only routed traffic can trigger. With preload on,
+    it is ready once the model (and the sharded workers, if any) are warm.
+    A failed state is not final: the preload thread keeps retrying, and
+    readiness turns true on the attempt that succeeds.
+    """
+    if not MODEL_PRELOAD:
+        return True
+    return MODEL_STATE["status"] == "warm" and (VECTORIZE_WORKERS <= 1 or MODEL_STATE["workers"] == "warm")
+
+
+# At startup:
+#
+#   if MODEL_PRELOAD:
+#       preload_model_async()
+#
+# Readiness, separate from /health (liveness). Load balancers route on this:
+#
+#   @app.route("/api/ready")
+#   def ready():
+#       return jsonify(MODEL_STATE), 200 if model_ready() else 503
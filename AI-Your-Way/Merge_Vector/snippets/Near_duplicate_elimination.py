@@ -0,0 +1,120 @@
+# Demonstrates: Deterministic near-duplicate elimination before embedding.
+# Phase 1 crawls produce boilerplate footers, mirrored pages and re-posted
+# articles. Embedding every copy wastes encoder time and index memory, and
+# the copies crowd each other out of top-k. MinHash signatures over word
+# shingles, bucketed with LSH, find near-duplicates in roughly linear time;
+# the first copy is kept and records the doc_ids it stands for.
+# Part of merge_vector.py. Not standalone.
+
+DEDUP_JACCARD_THRESHOLD = 0.85   # estimated shingle Jaccard at/above which a chunk is a duplicate
+DEDUP_SHINGLE_SIZE = 5           # words per shingle
+DEDUP_NUM_PERM = 128             # MinHash permutations (signature length)
+DEDUP_SEED = 1234                # permutation seed — same input, same survivors
+
+_MINHASH_PRIME = np.uint64(4294967311)   # smallest prime above 2**32
+
+
+def _lsh_bands(threshold: float, num_perm: int) -> tuple:
+    """
+    (bands, rows) with bands × rows = num_perm whose LSH S-curve midpoint,
+    (1/bands)^(1/rows), sits just below threshold. Erring low means more
+    candidates to verify and fewer missed duplicates; every candidate is
+    checked against the full signature anyway.
+    """
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    target = threshold * 0.9
+    return min(options, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - target))
+
+
+def _shingle_hashes(text: str, size: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """
+    32-bit CRC of each word shingle. CRC rather than hash(): Python's string
+    hash is salted per process, which would make dedup non-deterministic.
+    Texts shorter than one shingle hash as a single shingle.
+    """
+    words = text.lower().split()
+    if len(words) <= size:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64)
+
+
+def _minhash(shingles: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    One signature row: min over shingles of (a·x + b) mod p per permutation.
+    a, b < 2**32 and x < 2**32, so a·x + b fits in uint64 without wrapping.
+    """
+    return ((np.outer(a, shingles) + b[:, None]) % _MINHASH_PRIME).min(axis=1).astype(np.uint32)
+
+
+def deduplicate_documents(documents: list, threshold: float = DEDUP_JACCARD_THRESHOLD,
+                          shingle_size: int = DEDUP_SHINGLE_SIZE,
+                          num_perm: int = DEDUP_NUM_PERM) -> tuple:
+    """
+    Drops near-duplicate (text, metadata) documents before embedding.
+    Returns (kept_documents, duplicates_removed).
+
+    Determinism:
+    Documents are visited in input order. Each one is compared only with
+    documents already kept; the earliest kept match wins. The first
+    occurrence of a cluster therefore always survives, and the result
+    depends only on the input and DEDUP_SEED — never on hash salting,
+    dict ordering or thread timing.
+
+    Why compare against kept documents only:
+    Chaining through dropped documents lets A≈B, B≈C drop C even when A and
+    C are far apart. Comparing against survivors keeps every dropped chunk
+    within threshold of the chunk that replaces it.
+
+    Provenance:
+    A kept document with duplicates gets metadata["duplicate_doc_ids"],
+    the doc_ids of the chunks it stands for (#<position> when the dropped
+    chunk has no doc_id). The columnar store keeps it in its "extra" column.
+    """
+    if not documents:
+        return documents, 0
+
+    bands, rows = _lsh_bands(threshold, num_perm)
+    rng = np.random.default_rng(DEDUP_SEED)
+    a = rng.integers(1, 2**32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64)
+
+    buckets = {}          # (band, band bytes) -> kept positions, in input order
+    signatures = {}       # kept position -> signature
+    kept, duplicates = [], {}
+
+    for pos, (text, metadata) in enumerate(documents):
+        sig = _minhash(_shingle_hashes(text, shingle_size), a, b)
+        keys = [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+        candidates = sorted({k for key in keys for k in buckets.get(key, ())})
+        match = next((k for k in candidates
+                      if np.count_nonzero(signatures[k] == sig) / num_perm >= threshold), None)
+
+        if match is not None:
+            duplicates.setdefault(match, []).append(metadata.get("doc_id") or f"#{pos}")
+            continue
+
+        kept.append(pos)
+        signatures[pos] = sig
+        for key in keys:
+            buckets.setdefault(key, []).append(pos)
+
+    result = []
+    for pos in kept:
+        text, metadata = documents[pos]
+        if pos in duplicates:
+            metadata = dict(metadata) | {"duplicate_doc_ids": duplicates[pos]}
+        result.append((text, metadata))
+
+    return result, len(documents) - len(kept)
+
+
+# In the /api/vectorize endpoint (dedup=true):
+#
+#   index, documents, outliers_idx, build_info = build_faiss_index(
+#       documents, outlier_thresh, exclude_outliers,
+#       dedup_threshold=float(request.form.get("dedup_threshold", DEDUP_JACCARD_THRESHOLD))
+#   )
+#   # build_info["duplicates_removed"] lands in the blob next to outliers_removed
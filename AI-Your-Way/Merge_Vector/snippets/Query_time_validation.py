@@ -8,7 +8,7 @@ def topk_search_validation(meta_data: dict) -> tuple:
     """
     Validates that the loaded FAISS index matches the active embedding model.
 
-    Two checks before any query is executed:
+    Three checks before any query is executed:
 
     Check 1 — Model name match:
         The metadata blob stores the embedding model name used at index
@@ -22,7 +22,16 @@ def topk_search_validation(meta_data: dict) -> tuple:
         on some index types, producing garbage distances.
         Returns HTTP 409 (conflict) with expected vs. found values.
 
-    Both checks return actionable error messages — the caller knows exactly
+    Check 3 — Known backend:
+        A KB built with a quantized backend (int8_dynamic, onnx) holds
+        vectors that are close to, not equal to, fp32 ones. Querying it with
+        another backend shifts distances and neighbour order, so the query
+        is encoded with get_model(backend_of(meta_data)) — the KB's own
+        backend, not the server default. Blobs without embedding_backend
+        were built with fp32. A backend this server cannot load is rejected.
+        Returns HTTP 409 (conflict) with expected vs. found values.
+
+    All checks return actionable error messages — the caller knows exactly
     what model/dimension the index expects and what was provided.
     """
     if meta_data.get("embedding_model") != EMBEDDING_MODEL_NAME:
@@ -41,6 +50,14 @@ def topk_search_validation(meta_data: dict) -> tuple:
             "found": meta_data.get("embedding_dim")
         }, 409
 
+    if backend_of(meta_data) not in EMBEDDING_BACKENDS:
+        return False, {
+            "status": "error",
+            "message": "Unknown embedding backend — index was built with a backend this server cannot load",
+            "expected": list(EMBEDDING_BACKENDS),
+            "found": backend_of(meta_data)
+        }, 409
+
     return True, None, None
 
 
@@ -49,3 +66,5 @@ def topk_search_validation(meta_data: dict) -> tuple:
 #   valid, error_body, status_code = topk_search_validation(meta_data)
 #   if not valid:
 #       return jsonify(error_body), status_code
+#   apply_search_params(index, meta_data.get("index_params"))   # IVF nprobe / HNSW efSearch
+#   query_emb = get_model(backend_of(meta_data)).encode([query], convert_to_numpy=True)
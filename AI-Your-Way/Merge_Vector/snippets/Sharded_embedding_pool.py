@@ -0,0 +1,143 @@
+# Demonstrates: Multi-process sharded embedding for /api/vectorize.
+# One SentenceTransformer in one process leaves most cores of a 16-32 core
+# ingestion server idle. A pool of worker processes, each holding its own
+# copy of the model and a capped torch thread count, encodes batches in
+# parallel; vectors are reassembled in input order.
+# Output is byte-identical to get_model().encode(...) on the same call.
+# Part of merge_vector.py. Not standalone.
+
+VECTORIZE_WORKERS = 0              # 0 or 1 = single-process get_model(); >1 = sharded pool
+ENCODE_THREADS_PER_WORKER = 4      # torch intra-op threads per worker
+SHARDED_MAX_IN_FLIGHT = 2          # queued batches per worker — bounds parent RAM
+SHARDED_PARITY_CHECK = True        # re-encode one batch in-process and compare bytes
+
+_WORKER_MODEL = {}   # per worker process: loaded once by the initializer
+
+
+def _init_encode_worker(model_path: str, threads: int, backend: str):
+    """
+    Runs once in each worker process. Thread env vars are set before torch
+    starts its pools; set_num_threads caps intra-op parallelism so
+    workers × threads never oversubscribes the machine.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _WORKER_MODEL["model"] = load_embedder(model_path, backend)
+
+
+def _encode_batch(batch_no: int, texts: list) -> tuple:
+    vectors = _WORKER_MODEL["model"].encode(texts, convert_to_numpy=True, batch_size=len(texts))
+    return batch_no, np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def plan_batches(texts: list, batch_size: int) -> list:
+    """
+    The batches SentenceTransformer.encode itself would form for this call:
+    indices sorted by descending text length (the same np.argsort call it
+    makes internally), cut into batch_size slices.
+
+    Why replicate the plan instead of sharding contiguously:
+    Padding depends on which texts share a batch. Contiguous shards would
+    pad differently from the single-process call and change the last bits
+    of some vectors — enough to move a point across the outlier threshold.
+    Same batches → same padded tensors → same bytes.
+    """
+    order = np.argsort([-len(t) for t in texts])
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+
+class ShardedEncoder:
+    """
+    Drop-in for the model object: encode(texts, convert_to_numpy, batch_size)
+    returns the same (n, dim) float32 array the single model would.
+
+    Batches are streamed to the pool with at most
+    workers × SHARDED_MAX_IN_FLIGHT outstanding, and written into the output
+    array at their original row positions as they complete — completion
+    order never affects the result.
+    """
+
+    def __init__(self, workers: int = VECTORIZE_WORKERS,
+                 threads_per_worker: int = ENCODE_THREADS_PER_WORKER,
+                 model_path: str = EMBEDDING_MODEL_PATH):
+        self.workers = workers
+        # spawn, not fork: a forked copy of an initialized torch runtime can deadlock
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_encode_worker,
+            initargs=(model_path, threads_per_worker, EMBEDDING_BACKEND)
+        )
+
+    def encode(self, texts: list, convert_to_numpy: bool = True, batch_size: int = 32) -> np.ndarray:
+        texts = list(texts)
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        if not texts:
+            return out
+
+        batches = plan_batches(texts, batch_size)
+        max_in_flight = self.workers * SHARDED_MAX_IN_FLIGHT
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                batch_no, vectors = future.result()
+                out[batches[batch_no]] = vectors
+
+        for batch_no, rows in enumerate(batches):
+            if len(pending) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+            pending.add(self._pool.submit(_encode_batch, batch_no, [texts[i] for i in rows]))
+        drain(ALL_COMPLETED)
+
+        if SHARDED_PARITY_CHECK:
+            self._check_parity(texts, batches[0], out, batch_size)
+        return out
+
+    @staticmethod
+    def _check_parity(texts, rows, out, batch_size):
+        """
+        Re-encodes the first planned batch on the in-process model.
+        A mismatch (e.g. a BLAS build whose results vary with thread count)
+        fails the run rather than persisting an index a single-process
+        rebuild would not reproduce.
+        """
+        reference = get_model().encode([texts[i] for i in rows], convert_to_numpy=True,
+                                       batch_size=batch_size)
+        if not np.array_equal(np.asarray(reference, dtype=np.float32), out[rows]):
+            raise RuntimeError(
+                "Sharded encoding diverged from single-process output — "
+                "set VECTORIZE_WORKERS = 0 or match ENCODE_THREADS_PER_WORKER to the parent"
+            )
+
+    def warm_up(self):
+        """
+        Starts every worker process and runs one warm-up encode in each.
+        Workers spawn lazily, one per task that finds none idle, so
+        submitting `workers` tasks at once brings the whole pool up.
+        """
+        futures = [self._pool.submit(_encode_batch, i, WARMUP_TEXTS) for i in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def get_encoder():
+    """
+    get_model() when sharding is off; otherwise the process-wide
+    ShardedEncoder, started on first use and cached in MODEL_CACHE
+    alongside the model itself.
+    """
+    if VECTORIZE_WORKERS <= 1:
+        return get_model()
+    if "sharded" not in MODEL_CACHE:
+        MODEL_CACHE["sharded"] = ShardedEncoder(VECTORIZE_WORKERS)
+        atexit.register(MODEL_CACHE["sharded"].shutdown)
+    return MODEL_CACHE["sharded"]
@@ -0,0 +1,207 @@
+# Demonstrates: Streaming, bounded-memory vectorization for multi-GB JSONL corpora.
+# The in-memory path holds every line, every text and every embedding at once.
+# This path parses lazily, encodes in fixed-size batches, spills embeddings to a
+# memory-mapped file, and keeps the deterministic outlier pass exact by
+# computing mean/std in two full passes over the spill file.
+# Part of merge_vector.py. Not standalone.
+
+STREAM_ENCODE_BATCH = 2048    # texts per model.encode call — peak RAM scales with this
+STREAM_FORWARD_BATCH = 32     # texts per forward pass within a call; the sharded pool
+                              # spreads the STREAM_ENCODE_BATCH / STREAM_FORWARD_BATCH passes
+STREAM_STATS_CHUNK = 8192     # rows per pass over the spill file
+# The stats chunk is fixed and independent of STREAM_ENCODE_BATCH, so float64
+# accumulation order — and therefore which points are flagged — never depends
+# on the encode batch size chosen for a run.
+
+
+class SpilledDocuments:
+    """
+    Append-only on-disk (text, metadata) store backing a streaming build.
+
+    Holds a row count in RAM, plus a one-byte keep mask per document once
+    filtered. Iterable more than once (the columnar metadata writer makes one
+    pass per column) and supports len(), so it drops into
+    persist_index_artifacts unchanged. select() returns a filtered view
+    without copying the file.
+    """
+
+    def __init__(self, path, _rows=None, _keep=None):
+        self.path = Path(path)
+        self._rows = _rows or 0
+        self._keep = _keep            # bytearray mask, 1 = kept; None = all rows
+        self._writer = None if _rows is not None else open(self.path, "wb")
+
+    def append(self, doc: tuple):
+        self._writer.write(json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._rows += 1
+
+    def finish(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def select(self, keep_mask: bytearray) -> "SpilledDocuments":
+        return SpilledDocuments(self.path, _rows=self._rows, _keep=keep_mask)
+
+    def __len__(self) -> int:
+        if self._keep is None:
+            return self._rows
+        return sum(self._keep)
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            for i, line in enumerate(f):
+                if self._keep is None or self._keep[i]:
+                    text, metadata = json.loads(line)
+                    yield text, metadata
+
+    def close(self):
+        """Deletes the spill file. Call after persist_index_artifacts."""
+        self.finish()
+        self.path.unlink(missing_ok=True)
+
+
+def _streaming_mean_std(embeddings: np.ndarray, chunk: int = STREAM_STATS_CHUNK) -> tuple:
+    """
+    Exact two-pass mean and (population) std over a memory-mapped array.
+
+    Pass 1 sums rows in float64 to get the mean. Pass 2 sums squared
+    deviations from that mean. Unlike a running (Welford) update, the result
+    doesn't depend on the order rows arrive in, and the same input always
+    gives the same statistics.
+    """
+    n, d = embeddings.shape
+
+    total = np.zeros(d, dtype=np.float64)
+    for start in range(0, n, chunk):
+        total += embeddings[start:start + chunk].sum(axis=0, dtype=np.float64)
+    mean = total / n
+
+    sq_dev = np.zeros(d, dtype=np.float64)
+    for start in range(0, n, chunk):
+        diff = embeddings[start:start + chunk].astype(np.float64) - mean
+        sq_dev += (diff * diff).sum(axis=0)
+    std = np.sqrt(sq_dev / n)
+
+    return mean, std
+
+
+def build_faiss_index_streaming(path_or_file, outlier_thresh: float = 3.0,
+                                exclude_outliers: bool = True,
+                                batch_size: int = STREAM_ENCODE_BATCH,
+                                spill_dir: Path = VAULT_DIR,
+                                index_type: str = "flat", index_params: dict = None,
+                                embedding_cache=None):
+    """
+    Streaming counterpart of build_faiss_index. Same outlier rule, same
+    (index, documents, outliers_idx, build_info) return shape.
+
+    Deterministic on its own terms — the same input always gives the same
+    index — and equivalent to build_faiss_index within float tolerance, not
+    bit-for-bit: mean/std here accumulate in float64 over fixed chunks
+    where the in-memory path uses float32 over the whole array, and
+    model.encode sees different batch compositions. A point lying within
+    rounding of the threshold can be flagged by one path and kept by the other.
+
+    Step 1: iter_jsonl → batches of batch_size texts → model.encode →
+            raw float32 appended to a spill file; documents spilled alongside
+    Step 2: spill file memory-mapped as an (n, EMBEDDING_DIM) array
+    Step 3: exact two-pass mean/std over the full set (deterministic)
+    Step 4: third pass flags rows whose centroid distance exceeds
+            outlier_thresh × std_norm — the same test as the in-memory path
+    Step 5: kept rows added to the requested index type chunk by chunk
+
+    Peak RAM is one encode batch plus one stats chunk, plus the index itself —
+    IndexFlatL2 stores every kept vector, so very large corpora should pair
+    this with a compressed index type.
+
+    Encoding goes through get_encoder(), so with VECTORIZE_WORKERS > 1 each
+    batch's forward passes (STREAM_FORWARD_BATCH texts each) run across the
+    sharded pool. Its batch plan is the one a single model.encode call
+    makes, so the spill file is byte-identical either way.
+
+    With an EmbeddingCache each batch is served from the cache where the
+    text hash is known; only misses reach model.encode, and
+    build_info["embedding_cache"] records how many rows each side supplied.
+
+    The returned documents are a SpilledDocuments view; call .close() on
+    it after persisting to delete the spill files.
+    """
+    model = get_encoder()   # get_model(), or the sharded pool when VECTORIZE_WORKERS > 1
+
+    cache_usage = {"reused": 0, "encoded": 0}
+
+    def encode(batch):
+        if embedding_cache is not None:
+            return embedding_cache.encode(model, batch, batch_size=batch_size,
+                                          forward_batch_size=STREAM_FORWARD_BATCH, usage=cache_usage)
+        return model.encode(batch, convert_to_numpy=True, batch_size=STREAM_FORWARD_BATCH)
+
+    token = uuid.uuid4().hex
+    emb_path = Path(spill_dir) / f".spill_{token}.f32"
+    documents = SpilledDocuments(Path(spill_dir) / f".spill_{token}.jsonl")
+
+    # Step 1: lazy parse + fixed-size batched encode, spilled to disk
+    n = 0
+    try:
+        with open(emb_path, "wb") as emb_file:
+            batch = []
+            for doc in iter_jsonl(path_or_file):
+                documents.append(doc)
+                batch.append(doc[0])
+                if len(batch) == batch_size:
+                    emb_file.write(np.ascontiguousarray(
+                        encode(batch), dtype=np.float32
+                    ).tobytes())
+                    n += len(batch)
+                    batch = []
+            if batch:
+                emb_file.write(np.ascontiguousarray(
+                    encode(batch), dtype=np.float32
+                ).tobytes())
+                n += len(batch)
+        documents.finish()
+
+        if n == 0:
+            raise RuntimeError("No valid documents in JSONL input")
+
+        # Step 2: memory-map the complete embedding set
+        embeddings = np.memmap(emb_path, dtype=np.float32, mode="r", shape=(n, EMBEDDING_DIM))
+
+        # Step 3: exact statistics from ALL embeddings before any filtering
+        mean, std = _streaming_mean_std(embeddings)
+        std_norm = np.linalg.norm(std)
+
+        # Step 4: flag outliers by L2 distance from centroid
+        keep = np.ones(n, dtype=bool)
+        if exclude_outliers and std_norm > 0:
+            for start in range(0, n, STREAM_STATS_CHUNK):
+                chunk = embeddings[start:start + STREAM_STATS_CHUNK].astype(np.float64)
+                distances = np.linalg.norm(chunk - mean, axis=1)
+                keep[start:start + len(chunk)] = distances <= outlier_thresh * std_norm
+        outliers_idx = np.flatnonzero(~keep).tolist()
+
+        # Step 5: build the index from kept rows, chunk by chunk
+        index, build_info = build_search_index(embeddings, index_type, index_params, keep=keep)
+        if embedding_cache is not None:
+            build_info["embedding_cache"] = cache_usage
+
+        del embeddings
+    except Exception:
+        documents.close()
+        raise
+    finally:
+        emb_path.unlink(missing_ok=True)
+
+    return index, documents.select(bytearray(keep.astype(np.uint8))), outliers_idx, build_info
+
+
+# In the /api/vectorize endpoint (stream=true):
+#
+#   index, documents, outliers_idx, build_info = build_faiss_index_streaming(
+#       request.files["jsonl_file"], outlier_thresh, exclude_outliers, index_type=index_type
+#   )
+#   try:
+#       faiss_file, meta_file = persist_index_artifacts(index, documents, outliers_idx, build_info)
+#   finally:
+#       documents.close()
@@ -25,21 +25,44 @@ def get_versioned_filename(file_type: str, model_name: str, ext: str) -> str:
 # and validates them against the active embedding model.
 # No fields are optional: missing any of these causes a load-time error,
 # not a silent query-time degradation.
+#
+# META_FORMAT selects the on-disk layout of the documents:
+#   "columnar" — memory-mapped .mmeta (see Columnar_metadata_store.py), rows
+#                materialized lazily by FAISS id. Default.
+#   "pickle"   — legacy .pkl blob, loaded and expanded in full.
+# Both carry the same contract fields; readers accept either.
+
+META_FORMAT = "columnar"
+
+def persist_index_artifacts(index, filtered_documents, outliers_idx, build_info=None):
+    meta_ext = COLUMNAR_META_EXT if META_FORMAT == "columnar" else "pkl"
 
-def persist_index_artifacts(index, filtered_documents, outliers_idx):
     faiss_index_file = get_versioned_filename("faiss_index", "mpnet", "bin")
-    meta_map_file    = get_versioned_filename("meta_map",    "mpnet", "pkl")
+    meta_map_file    = get_versioned_filename("meta_map",    "mpnet", meta_ext)
 
     faiss.write_index(index, faiss_index_file)
 
-    with open(meta_map_file, "wb") as f:
-        pickle.dump({
-            "embedding_model": EMBEDDING_MODEL_NAME,   # validated by ask_ai at load time
-            "embedding_dim":   EMBEDDING_DIM,          # validated by ask_ai at load time
-            "created_at":      datetime.utcnow().isoformat(),
-            "total_chunks":    len(filtered_documents),
-            "outliers_removed": len(outliers_idx),
-            "documents":       filtered_documents      # (text, metadata) pairs — full Phase 1 provenance
-        }, f)
+    blob_fields = {
+        "embedding_model": EMBEDDING_MODEL_NAME,   # validated by ask_ai at load time
+        "embedding_dim":   EMBEDDING_DIM,          # validated by ask_ai at load time
+        "embedding_backend": EMBEDDING_BACKEND,    # fp32 / int8_dynamic / onnx — validated likewise
+        "created_at":      datetime.utcnow().isoformat(),
+        "total_chunks":    len(filtered_documents),
+        "outliers_removed": len(outliers_idx),
+        "duplicates_removed": 0,                   # overridden by build_info when dedup ran
+        # index_type, index_factory, index_params (nprobe / ef_search honoured
+        # by ask_ai at load time), measured recall_at_k, and embedding_cache
+        # {reused, encoded} on incremental builds
+        **(build_info or {"index_type": "flat"}),
+    }
+
+    if META_FORMAT == "columnar":
+        # (text, metadata) pairs — full Phase 1 provenance, one column per field
+        write_columnar_meta(meta_map_file, blob_fields, filtered_documents)
+    else:
+        with open(meta_map_file, "wb") as f:
+            pickle.dump(blob_fields | {
+                "documents": list(filtered_documents)    # (text, metadata) pairs — full Phase 1 provenance
+            }, f)
 
     return faiss_index_file, meta_map_file
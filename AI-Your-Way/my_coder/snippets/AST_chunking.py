@@ -1,61 +1,218 @@
 # Demonstrates: AST-aware semantic chunking for RAG indexing.
 # One function/class = one chunk. Preserves syntactic boundaries instead of splitting mid-function.
+# A single visitor pass emits each chunk with its importance features; reference
+# frequency comes from a repo-wide symbol index built in one tokenize pass per
+# file, which also answers "who calls X". Files are chunked in a process pool.
 # Part of RAGEngine in my_coder.py. Not standalone.
 
-def _chunk_by_ast(self, code_text: str) -> list:
+CHUNK_WORKERS = 0                # 0 = os.cpu_count(); 1 = always in-process
+CHUNK_PARALLEL_MIN_FILES = 8     # fewer changed files than this: a pool costs more than it saves
+
+
+def _source_lines(code_text: str) -> list:
+    """Lines split exactly as ast.get_source_segment splits them (\\n, \\r\\n, \\r — not \\f)."""
+    return io.StringIO(code_text, newline="").readlines()
+
+
+def _segment(lines: list, node) -> str:
     """
-    Splits code at function/class boundaries using the AST.
-    Falls back to character-based chunking if parsing fails.
+    ast.get_source_segment over pre-split lines. The stdlib version
+    re-splits the whole file on every call — once per definition.
+    Column offsets are UTF-8 byte offsets, hence the encode/decode.
     """
-    try:
-        tree = ast.parse(code_text)
-    except SyntaxError:
-        return [{"text": chunk, "type": "fallback", "name": "unknown", "importance": 0.5}
-                for chunk in self._chunk_text(code_text)]
+    first, last = node.lineno - 1, node.end_lineno - 1
+    if first == last:
+        return lines[first].encode()[node.col_offset:node.end_col_offset].decode()
+    head = lines[first].encode()[node.col_offset:].decode()
+    tail = lines[last].encode()[:node.end_col_offset].decode()
+    return head + "".join(lines[first + 1:last]) + tail
+
+
+class ChunkVisitor(ast.NodeVisitor):
+    """
+    One pass over the module. Each function/class reached from module level
+    becomes a chunk carrying its importance features; the visitor never
+    descends into a definition, so nested functions and methods stay inside
+    their parent's chunk instead of leaking out as chunks of their own.
+    """
+
+    def __init__(self, lines: list):
+        self.lines = lines
+        self.chunks = []
 
-    chunks = []
-    for node in ast.walk(tree):
-        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-            # Skip nested functions/methods — top-level only
-            parent = getattr(node, 'parent', None)
-            if parent and isinstance(parent, (ast.FunctionDef, ast.ClassDef)):
-                continue
-
-            chunk_text = ast.get_source_segment(code_text, node)
-            if not chunk_text:
-                continue
-
-            chunks.append({
-                "text": chunk_text,
-                "type": "function" if isinstance(node, ast.FunctionDef) else "class",
+    def _emit(self, node, kind: str):
+        text = _segment(self.lines, node)
+        if text:
+            self.chunks.append({
+                "text": text,
+                "type": kind,
                 "name": node.name,
-                "importance": self._calculate_importance(node, code_text),
                 "start_line": node.lineno,
-                "end_line": getattr(node, 'end_lineno', node.lineno)
+                "end_line": node.end_lineno,
+                "has_docstring": bool(ast.get_docstring(node)),
+                "line_count": len(text.splitlines())
             })
 
-    return chunks or [{"text": chunk, "type": "fallback", "name": "module", "importance": 0.5}
-                      for chunk in self._chunk_text(code_text)]
+    def visit_FunctionDef(self, node):
+        self._emit(node, "function")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._emit(node, "class")
+
+
+def chunk_source(code_text: str):
+    """Chunks for one file: None if it does not parse, [] if it defines nothing."""
+    try:
+        tree = ast.parse(code_text)
+    except SyntaxError:
+        return None
+    visitor = ChunkVisitor(_source_lines(code_text))
+    visitor.visit(tree)
+    return visitor.chunks
+
+
+def scan_symbols(code_text: str) -> tuple:
+    """
+    One tokenize pass: (refs, calls).
+    refs  — {identifier: occurrences}, keywords excluded
+    calls — {identifier: [line, ...]} where the identifier is followed by "("
+            and is not being defined (def f( / class C( are not calls)
+    Strings and comments are single tokens, so a name mentioned in a
+    docstring is not counted — unlike full_code.count(name).
+    """
+    refs, calls = Counter(), {}
+    prev = before_prev = None
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(code_text).readline):
+            if tok.type == tokenize.NAME and not keyword.iskeyword(tok.string):
+                refs[tok.string] += 1
+            elif (tok.string == "(" and prev is not None and prev.type == tokenize.NAME
+                  and not keyword.iskeyword(prev.string)
+                  and not (before_prev and before_prev.string in ("def", "class"))):
+                calls.setdefault(prev.string, []).append(prev.start[0])
+            if tok.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT,
+                                tokenize.INDENT, tokenize.DEDENT):
+                before_prev, prev = prev, tok
+    except (tokenize.TokenError, SyntaxError):
+        pass   # unterminated file: keep what was scanned
+    return dict(refs), calls
+
+
+def index_source(path: str, code_text: str) -> dict:
+    """
+    Process-pool entry point: chunks and symbol scan for one file.
+    Module-level so the pool can pickle it; touches no RAGEngine state.
+    """
+    refs, calls = scan_symbols(code_text)
+    return {"path": path, "chunks": chunk_source(code_text), "refs": refs, "calls": calls}
+
+
+def index_sources(sources: list, workers: int = CHUNK_WORKERS) -> list:
+    """
+    index_source over [(path, code_text), ...], results in input order.
+    Parsing and tokenizing are CPU-bound and hold the GIL, so a full sync
+    uses a process pool; a save-time re-index of one file stays in-process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(sources) < CHUNK_PARALLEL_MIN_FILES:
+        return [index_source(path, code) for path, code in sources]
+    paths, codes = zip(*sources)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(index_source, paths, codes, chunksize=max(1, len(sources) // (workers * 4))))
 
 
-def _calculate_importance(self, node, full_code: str) -> float:
+class SymbolIndex:
+    """
+    Repo-wide identifier counts and call sites, merged from per-file scans.
+
+    files  — {path: {"refs": {...}, "calls": {...}}}, as scan_symbols returned
+    totals — Counter of refs summed over every file
+
+    Per-file entries are kept (and persisted in the index manifest) so a
+    changed file swaps out only its own contribution.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.totals = Counter()
+
+    @classmethod
+    def from_manifest(cls, manifest_files: dict):
+        index = cls()
+        for path, entry in manifest_files.items():
+            index.update(path, entry.get("refs", {}), entry.get("calls", {}))
+        return index
+
+    def update(self, path: str, refs: dict, calls: dict):
+        self.remove(path)
+        self.files[path] = {"refs": refs, "calls": calls}
+        self.totals.update(refs)
+
+    def remove(self, path: str):
+        old = self.files.pop(path, None)
+        if old:
+            self.totals.subtract(old["refs"])
+            for name in old["refs"]:
+                if self.totals[name] <= 0:
+                    del self.totals[name]
+
+    def ref_count(self, name: str) -> int:
+        return self.totals.get(name, 0)
+
+    def call_sites(self, name: str) -> list:
+        """[(path, line), ...] for every call to name, in path order."""
+        return [(path, line) for path in sorted(self.files)
+                for line in self.files[path]["calls"].get(name, ())]
+
+
+def chunk_importance(chunk: dict, ref_count: int) -> float:
     """
     Weights each chunk for retrieval priority.
-    Factors: docstring presence, code length, reference frequency in codebase.
+    Factors: docstring presence, code length, reference frequency across the repository.
     """
     importance = 0.5  # base
-
-    if ast.get_docstring(node):
+    if chunk.get("has_docstring"):
         importance += 0.2  # documented code ranks higher
+    importance += min(0.3, chunk.get("line_count", 0) / 100)  # longer = more substantial
+    importance += min(0.2, ref_count / 20)  # frequently referenced = more important
+    return min(1.0, importance)
 
-    try:
-        lines = len(ast.get_source_segment(full_code, node).splitlines())
-        importance += min(0.3, lines / 100)  # longer = more substantial
-    except:
-        pass
 
-    if hasattr(node, 'name'):
-        ref_count = full_code.count(node.name)
-        importance += min(0.2, ref_count / 20)  # frequently referenced = more important
+def _chunk_by_ast(self, code_text: str) -> list:
+    """
+    Splits code at function/class boundaries using the AST.
+    Falls back to character-based chunking if parsing fails.
+    """
+    return self._finish_chunks(chunk_source(code_text), code_text)
 
-    return min(1.0, importance)
+
+def _finish_chunks(self, chunks, code_text: str, symbols: SymbolIndex = None) -> list:
+    """
+    Scores chunk_source output (from this process or a pool worker), or falls back.
+    symbols defaults to self.symbols; reindex passes the index it is building.
+    """
+    symbols = symbols if symbols is not None else self.symbols
+    if chunks is None:
+        return [{"text": chunk, "type": "fallback", "name": "unknown", "importance": 0.5}
+                for chunk in self._chunk_text(code_text)]
+    if not chunks:
+        return [{"text": chunk, "type": "fallback", "name": "module", "importance": 0.5}
+                for chunk in self._chunk_text(code_text)]
+    for chunk in chunks:
+        chunk["importance"] = chunk_importance(chunk, symbols.ref_count(chunk["name"]))
+    return chunks
+
+
+def callers(self, name: str) -> list:
+    """
+    "Who calls X": the indexed chunks whose line range contains a call to
+    name, found from the symbol index — no embedding, no similarity search.
+    """
+    lines_by_file = {}
+    for path, line in self.symbols.call_sites(name):
+        lines_by_file.setdefault(path, []).append(line)
+    return [entry for entry in self.metadata
+            if entry.get("file") in lines_by_file and entry.get("name") != name and "start_line" in entry
+            and any(entry["start_line"] <= line <= entry["end_line"] for line in lines_by_file[entry["file"]])]
@@ -0,0 +1,208 @@
+# Demonstrates: Batched, pooled embedding client for RAGEngine.
+# _get_embedding used to make one HTTP round-trip to Ollama per chunk, so
+# indexing a repository was bound by request latency, not the model.
+# Chunks are now sent many per /api/embed request over a keep-alive
+# connection pool, with a bounded number of requests in flight, retries with
+# backoff on transient failures, and a persistent cache keyed by
+# (chunk hash, model) so a chunk is embedded once per model, ever.
+# Part of RAGEngine in my_coder.py. Not standalone.
+
+OLLAMA_BASE_URL = "http://localhost:11434"
+RAG_EMBED_DIM = 768                 # nomic-embed-text
+EMBED_BATCH_SIZE = 64               # chunks per /api/embed request
+EMBED_MAX_IN_FLIGHT = 4             # concurrent requests (and pooled connections)
+EMBED_TIMEOUT = 60                  # seconds per request
+EMBED_RETRIES = 4                   # attempts after the first
+EMBED_BACKOFF_BASE = 0.5            # seconds; doubles per attempt, with jitter
+EMBED_BACKOFF_MAX = 8.0
+EMBED_MODEL_KEEP_ALIVE = "10m"      # keeps the model resident in Ollama between batches
+EMBED_CACHE_DIR = VIBE_INDEX_DIR / "embed_cache"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class TransientEmbedError(RuntimeError):
+    """A failure worth retrying: connection drop, timeout, 429 or 5xx."""
+
+
+class ChunkEmbeddingCache:
+    """
+    Append-only vector store for one embedding model, in EMBED_CACHE_DIR:
+        {model}.keys — 32-byte chunk digests (sha256 of the text), one per row
+        {model}.f32  — raw float32 vectors, same row order
+
+    Vectors are flushed before their keys and both files are truncated to
+    the row count they agree on at open, so a crash loses at most the
+    unflushed tail — never a key without its vector.
+    """
+
+    def __init__(self, model: str = RAG_EMBED_MODEL, dim: int = RAG_EMBED_DIM,
+                 cache_dir: Path = EMBED_CACHE_DIR):
+        self.model = model
+        self.dim = dim
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        stem = model.replace("/", "_").replace(":", "_")
+        self.keys_path = cache_dir / f"{stem}.keys"
+        self.vecs_path = cache_dir / f"{stem}.f32"
+        self._lock = threading.Lock()
+
+        self.keys_path.touch(exist_ok=True)
+        self.vecs_path.touch(exist_ok=True)
+        rows = min(self.keys_path.stat().st_size // 32, self.vecs_path.stat().st_size // (dim * 4))
+        for path, size in ((self.keys_path, rows * 32), (self.vecs_path, rows * dim * 4)):
+            if path.stat().st_size != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+        keys = self.keys_path.read_bytes()
+        self._rows = {keys[i:i + 32]: i // 32 for i in range(0, len(keys), 32)}
+        self._remap()
+
+    def _remap(self):
+        n = len(self._rows)
+        self._vectors = (np.memmap(self.vecs_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+                         if n else np.empty((0, self.dim), dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, keys: list) -> dict:
+        with self._lock:
+            return {k: np.array(self._vectors[self._rows[k]]) for k in keys if k in self._rows}
+
+    def put(self, keys: list, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise RuntimeError(f"'{self.model}' returned {vectors.shape[1]}D vectors, cache expects {self.dim}D")
+        with self._lock:
+            fresh = [(k, v) for k, v in zip(keys, vectors) if k not in self._rows]
+            if not fresh:
+                return
+            with open(self.vecs_path, "ab") as f:
+                f.write(b"".join(v.tobytes() for _, v in fresh))
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(k for k, _ in fresh))
+            start = len(self._rows)
+            for offset, (k, _) in enumerate(fresh):
+                self._rows[k] = start + offset
+            self._remap()
+
+
+class OllamaEmbeddingClient:
+    """
+    embed(texts) → (n, dim) float32, in input order.
+
+    Cached chunks are served from disk; the rest are de-duplicated, cut
+    into EMBED_BATCH_SIZE batches and posted to /api/embed on a thread
+    pool of EMBED_MAX_IN_FLIGHT workers sharing one keep-alive session.
+    Each finished batch is cached immediately, so a run that fails half
+    way resumes from where it stopped.
+
+    base_url is a parameter so the client can be pointed at a stub HTTP
+    server that speaks the same /api/embed shape.
+    """
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, model: str = RAG_EMBED_MODEL,
+                 batch_size: int = EMBED_BATCH_SIZE, max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+                 cache: ChunkEmbeddingCache = None):
+        self.url = base_url.rstrip("/") + "/api/embed"
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = cache
+        self.counters = {"cached": 0, "embedded": 0, "requests": 0, "retries": 0}
+        self._lock = threading.Lock()   # counters are bumped from the pool threads
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight,
+                                                pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed")
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _post(self, batch: list) -> np.ndarray:
+        for attempt in range(EMBED_RETRIES + 1):
+            try:
+                self._count("requests")
+                r = self.session.post(self.url, timeout=EMBED_TIMEOUT, json={
+                    "model": self.model, "input": batch, "keep_alive": EMBED_MODEL_KEEP_ALIVE
+                })
+                if r.status_code in RETRYABLE_STATUS:
+                    raise TransientEmbedError(f"HTTP {r.status_code}")
+                r.raise_for_status()   # other 4xx: bad model name, bad payload — retrying won't help
+                vectors = r.json()["embeddings"]
+                if len(vectors) != len(batch):
+                    raise RuntimeError(f"Sent {len(batch)} chunks, got {len(vectors)} embeddings")
+                return np.asarray(vectors, dtype=np.float32)
+            except (requests.ConnectionError, requests.Timeout, TransientEmbedError):
+                if attempt == EMBED_RETRIES:
+                    raise
+                self._count("retries")
+                time.sleep(min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def embed(self, texts: list, use_cache: bool = True) -> np.ndarray:
+        cache = self.cache if use_cache else None
+        keys = [bytes.fromhex(chunk_hash(t)) for t in texts]
+        found = cache.get(keys) if cache is not None else {}
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        miss_keys = list(missing)
+        batches = [miss_keys[i:i + self.batch_size] for i in range(0, len(miss_keys), self.batch_size)]
+
+        futures = {self._pool.submit(self._post, [missing[k] for k in batch]): batch for batch in batches}
+        try:
+            for future in as_completed(futures):
+                batch, vectors = futures[future], future.result()
+                if cache is not None:
+                    cache.put(batch, vectors)
+                found.update(zip(batch, vectors))
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        self._count("cached", len(texts) - len(miss_keys))
+        self._count("embedded", len(miss_keys))
+        if not texts:
+            return np.empty((0, RAG_EMBED_DIM), dtype=np.float32)
+        return np.stack([found[k] for k in keys])
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+
+
+def _get_embeddings(self, texts: list, use_cache: bool = True):
+    """
+    Batch embeddings for indexing. Returns None if Ollama stays
+    unreachable after retries — callers keep their previous state.
+    """
+    try:
+        return self.embedder.embed(texts, use_cache=use_cache)
+    except Exception as e:
+        print(f"[RAG] Embedding failed: {e}")
+        return None
+
+
+def _get_embedding(self, text: str):
+    """
+    Single text — the query path. Same pooled connection, but queries
+    are not cached: they are one-off and would only grow the store.
+    """
+    vectors = self._get_embeddings([text], use_cache=False)
+    return None if vectors is None else vectors[0]
+
+
+# RAGEngine.__init__:
+#
+#   self.embedder = OllamaEmbeddingClient(cache=ChunkEmbeddingCache())
+#   atexit.register(self.embedder.close)
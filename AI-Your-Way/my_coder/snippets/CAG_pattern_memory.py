@@ -1,41 +1,357 @@
 # Demonstrates: CAG (Cache-Augmented Generation) pattern learning.
 # Accepted code changes are stored as learned patterns and retrieved by relevance scoring
 # on future requests — giving the system persistent memory without retraining.
+# Patterns live in an inverted token index (plus optional embeddings), so retrieval
+# stays sub-millisecond at 100k+ patterns; eviction keeps the most confident and
+# most recent instead of a fixed 100-entry window.
 # Part of CAGMemory in my_coder.py. Not standalone.
 
+CAG_LOG_FILE = VIBE_INDEX_DIR / "learning_log.jsonl"          # append-only add/evict records
+CAG_LEGACY_LOG_FILE = VIBE_INDEX_DIR / "learning_log.json"    # old capped log, imported once
+CAG_VECTORS_FILE = VIBE_INDEX_DIR / "learning_vectors.f32"    # optional embeddings, one row per add
+
+CAG_MAX_PATTERNS = 200_000     # eviction starts above this
+CAG_EVICT_TO = 0.95            # ...and trims to this fraction, so it runs rarely
+CAG_HALF_LIFE_DAYS = 30        # a pattern's retention score halves every 30 days
+CAG_MAX_POSTING = 256          # per query token: this many newest ids plus this many by retention
+CAG_SEMANTIC_WEIGHT = 1.0      # cosine(query, intent + signature) added to the token score
+CAG_COMPACT_RATIO = 2.0        # rewrite the log once it holds 2x more records than live patterns
+CAG_USE_EMBEDDINGS = False     # embed intent + signature on add (one extra Ollama call per accepted change)
+
+_PATTERN_TOKEN_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def pattern_tokens(text: str) -> set:
+    """
+    Lower-cased word tokens; identifiers are split on case and underscores
+    so "getUserById", "get_user_by_id" and "get user by id" all match.
+    """
+    return {t.lower() for t in _PATTERN_TOKEN_RE.findall(text) if len(t) > 1}
+
+
+class PatternStore:
+    """
+    All learned patterns, indexed for retrieval.
+
+    entries       — {key: pattern dict}, the same shape add_success always stored
+    intent_index  — {token: [key, ...]} in insertion order (newest last)
+    sig_index     — same, over signatures
+    vectors       — optional (rows, dim) float32 memmap over CAG_VECTORS_FILE
+
+    Keys are assigned in insertion order and never reused, so per-pattern
+    numbers (confidence, timestamp, vector row, alive flag) live in flat
+    numpy arrays indexed by key — scoring and eviction never loop in Python.
+    Postings are append-only; evicted keys are masked out on read and
+    dropped when the log is compacted.
+
+    Persistence is an append-only JSONL log — {"op": "add", ...} and
+    {"op": "evict", "id": ...} — so learning a pattern writes one line
+    instead of re-serializing the whole store.
+    """
+
+    def __init__(self, log_path: Path = CAG_LOG_FILE, vectors_path: Path = CAG_VECTORS_FILE):
+        self.log_path = Path(log_path)
+        self.vectors_path = Path(vectors_path)
+        self.entries, self._keys_by_id = {}, {}
+        self.intent_index, self.sig_index = {}, {}
+        self._next_key = 0
+        self._log_records = 0
+        self._conf = np.zeros(1024, dtype=np.float32)
+        self._ts = np.zeros(1024, dtype=np.float64)
+        self._row = np.full(1024, -1, dtype=np.int64)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._top_postings = {}    # (index id, token) -> (posting length when ranked, keys)
+        self.dim = None
+        self._vector_count = 0
+        self.vectors = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    # -- loading / persistence ------------------------------------------------
+
+    @classmethod
+    def load(cls, log_path: Path = CAG_LOG_FILE, vectors_path: Path = CAG_VECTORS_FILE,
+             legacy_path: Path = CAG_LEGACY_LOG_FILE):
+        store = cls(log_path, vectors_path)
+        if store.log_path.exists():
+            with open(store.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue   # torn last line from a crash
+                    store._log_records += 1
+                    if record.get("op") == "evict":
+                        store._drop(record["id"])
+                    else:
+                        store.dim = record.get("dim") or store.dim
+                        store._index(record["entry"], record.get("row"))
+        elif Path(legacy_path).exists():
+            for entry in json.loads(Path(legacy_path).read_text()):
+                store._index(entry, None)
+            store.compact()
+        store._truncate_vectors()
+        store._map_vectors()
+        return store
+
+    def _truncate_vectors(self):
+        """
+        Cuts the vectors file back to whole rows on load, as ChunkEmbeddingCache
+        does at open. A crash mid-append leaves a partial row; the next add
+        would land after it and every later row would be read misaligned.
+        With no dim in the log no pattern owns a row, so the file is emptied.
+        """
+        if not self.vectors_path.exists():
+            return
+        size = self.vectors_path.stat().st_size
+        whole = size - size % (self.dim * 4) if self.dim else 0
+        if whole != size:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(whole)
+
+    def _map_vectors(self):
+        if not self.vectors_path.exists() or self.dim is None:
+            return
+        self._vector_count = self.vectors_path.stat().st_size // (self.dim * 4)
+        self.vectors = (np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                  shape=(self._vector_count, self.dim)) if self._vector_count else None)
+
+    def _append_log(self, records: list):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in records))
+        self._log_records += len(records)
+
+    def compact(self):
+        """Rewrites log and vectors with live patterns only (write + rename)."""
+        keys = sorted(self.entries)
+        rows = {}
+        if self.vectors is not None:
+            kept = [k for k in keys if self._row[k] >= 0]
+            tmp = self.vectors_path.with_suffix(".tmp")
+            np.ascontiguousarray(self.vectors[self._row[kept]], dtype=np.float32).tofile(tmp)
+            rows = {k: row for row, k in enumerate(kept)}
+            os.replace(tmp, self.vectors_path)
+
+        tmp = self.log_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for k in keys:
+                f.write(json.dumps({"op": "add", "entry": self.entries[k], "row": rows.get(k),
+                                    "dim": self.dim if k in rows else None}) + "\n")
+        os.replace(tmp, self.log_path)
+
+        self._row[:] = -1
+        for k, row in rows.items():
+            self._row[k] = row
+        self._log_records = len(keys)
+        for index in (self.intent_index, self.sig_index):
+            for token in list(index):
+                index[token] = [k for k in index[token] if self._alive[k]]
+                if not index[token]:
+                    del index[token]
+        self._top_postings.clear()
+        self._map_vectors()
+
+    # -- indexing -------------------------------------------------------------
+
+    def _index(self, entry: dict, row):
+        if entry["id"] in self._keys_by_id:          # legacy HHMMSS ids can collide
+            entry = entry | {"id": f"{entry['id']}-{self._next_key}"}
+        key = self._next_key
+        self._next_key += 1
+        if key == len(self._alive):
+            for name in ("_conf", "_ts", "_row", "_alive"):
+                arr = getattr(self, name)
+                grown = np.full(len(arr) * 2, -1 if name == "_row" else 0, dtype=arr.dtype)
+                grown[:len(arr)] = arr
+                setattr(self, name, grown)
+
+        self.entries[key] = entry
+        self._keys_by_id[entry["id"]] = key
+        self._conf[key] = entry.get("confidence", 0.5)
+        self._row[key] = -1 if row is None else row
+        self._alive[key] = True
+        try:
+            self._ts[key] = datetime.datetime.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+        except (KeyError, ValueError):
+            self._ts[key] = 0.0
+        for token in pattern_tokens(entry.get("user_intent", "")):
+            self.intent_index.setdefault(token, []).append(key)
+        for token in pattern_tokens(entry.get("signature", "")):
+            self.sig_index.setdefault(token, []).append(key)
+        return key
+
+    def _drop(self, pattern_id: str):
+        key = self._keys_by_id.pop(pattern_id, None)
+        if key is not None:
+            self.entries.pop(key, None)
+            self._alive[key] = False
+
+    def add(self, entry: dict, vector=None):
+        row = None
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32).ravel()
+            vector = vector / (np.linalg.norm(vector) + 1e-12)
+            if self.dim is None:
+                self.dim = len(vector)
+                self._map_vectors()
+            if len(vector) == self.dim:
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vector.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                row = self._vector_count
+                self._map_vectors()
+
+        key = self._index(entry, row)
+        self._append_log([{"op": "add", "entry": self.entries[key], "row": row,
+                           "dim": self.dim if row is not None else None}])
+        if len(self.entries) > CAG_MAX_PATTERNS:
+            self.evict()
+        return self.entries[key]
+
+    # -- eviction -------------------------------------------------------------
+
+    def retention(self, keys: np.ndarray, now: float) -> np.ndarray:
+        """confidence × 0.5^(age / half-life): old, unsure patterns go first."""
+        age_days = np.maximum(0.0, now - self._ts[keys]) / 86400
+        return self._conf[keys] * 0.5 ** (age_days / CAG_HALF_LIFE_DAYS)
+
+    def evict(self):
+        """
+        Trims to CAG_EVICT_TO × CAG_MAX_PATTERNS by lowest retention score.
+        One vectorized pass per ~5% of growth, not per add.
+        """
+        excess = len(self.entries) - int(CAG_MAX_PATTERNS * CAG_EVICT_TO)
+        if excess <= 0:
+            return
+        live = np.flatnonzero(self._alive[:self._next_key])
+        victims = live[np.argpartition(self.retention(live, time.time()), excess - 1)[:excess]]
+        ids = [self.entries[int(k)]["id"] for k in victims]
+        for pattern_id in ids:
+            self._drop(pattern_id)
+        self._append_log([{"op": "evict", "id": pattern_id} for pattern_id in ids])
+        if self._log_records > CAG_COMPACT_RATIO * max(1, len(self.entries)):
+            self.compact()
+
+    # -- retrieval ------------------------------------------------------------
+
+    def _retention_rank(self, keys: np.ndarray) -> np.ndarray:
+        """
+        log(retention) plus a term every key shares at any given moment.
+        Decay is the same for all patterns, so ordering by this equals
+        ordering by retention() now or later — a ranking can be cached.
+        """
+        return (np.log(np.maximum(self._conf[keys], 1e-12))
+                + self._ts[keys] * (np.log(2) / (CAG_HALF_LIFE_DAYS * 86400)))
+
+    def _posting_candidates(self, index: dict, token: str) -> list:
+        """
+        Ids read for one query token: the whole posting when it is short,
+        else its newest CAG_MAX_POSTING ids plus its CAG_MAX_POSTING
+        highest-retention ids.
+
+        The retention ranking is cached per token and recomputed once more
+        than CAG_MAX_POSTING ids have been appended since — until then every
+        newer id is inside the newest slice, so the union is exactly the
+        posting's top-retention ids plus its newest. Evicted ids stay in a
+        cached ranking until it is rebuilt and are masked by the caller.
+        """
+        posting = index.get(token, ())
+        if len(posting) <= CAG_MAX_POSTING:
+            return posting
+        cache_key = (id(index), token)
+        cached = self._top_postings.get(cache_key)
+        if cached is None or len(posting) - cached[0] > CAG_MAX_POSTING:
+            keys = np.array(posting, dtype=np.int64)
+            keys = keys[self._alive[keys]]
+            if len(keys) > CAG_MAX_POSTING:
+                keys = keys[np.argpartition(-self._retention_rank(keys), CAG_MAX_POSTING - 1)[:CAG_MAX_POSTING]]
+            cached = self._top_postings[cache_key] = (len(posting), keys.tolist())
+        return list(set(cached[1]).union(posting[-CAG_MAX_POSTING:]))
+
+    def query(self, query: str, k: int = 2, query_vec=None) -> list:
+        """
+        Top-k patterns for query, best first (newest wins a tie).
+
+        score = (2 × intent_overlap + 1 × signature_overlap
+                 + CAG_SEMANTIC_WEIGHT × cosine) × confidence
+
+        overlap is the fraction of query tokens found, so a query contained
+        whole in the intent scores 2 — the old substring rule's value.
+        Cosine is used only when query_vec is given and the pattern has a
+        vector. Candidates come from the postings of the query tokens, at
+        most 2 × CAG_MAX_POSTING per token (_posting_candidates), so cost
+        tracks the query, not the store.
+
+        Trade-off: for a token shared by more than CAG_MAX_POSTING patterns,
+        a pattern that is neither among its newest nor among its
+        highest-retention ids is not scored through that token — it is
+        still found through the query's rarer tokens. The ones skipped are
+        old and low-confidence, the first eviction would drop anyway.
+        """
+        tokens = pattern_tokens(query)
+        if not tokens:
+            return []
+        intent_ids = [key for t in tokens for key in self._posting_candidates(self.intent_index, t)]
+        sig_ids = [key for t in tokens for key in self._posting_candidates(self.sig_index, t)]
+        if not intent_ids and not sig_ids:
+            return []
+
+        keys, inverse = np.unique(np.array(intent_ids + sig_ids, dtype=np.int64), return_inverse=True)
+        intent_hits = np.bincount(inverse[:len(intent_ids)], minlength=len(keys))
+        sig_hits = np.bincount(inverse[len(intent_ids):], minlength=len(keys))
+        alive = self._alive[keys]
+        keys, intent_hits, sig_hits = keys[alive], intent_hits[alive], sig_hits[alive]
+        scores = (2 * intent_hits + sig_hits) / len(tokens)
+
+        if query_vec is not None and self.vectors is not None and len(keys):
+            q = np.asarray(query_vec, dtype=np.float32).ravel()
+            if len(q) == self.dim:
+                q = q / (np.linalg.norm(q) + 1e-12)
+                rows = self._row[keys]
+                has = rows >= 0
+                if has.any():
+                    scores[has] += CAG_SEMANTIC_WEIGHT * (self.vectors[rows[has]] @ q)
+
+        scores = scores * self._conf[keys]
+        order = np.lexsort((-keys, -scores))[:k]
+        return [self.entries[int(keys[i])] for i in order if scores[i] > 0]
+
+
 def add_success(self, signature: str, user_intent: str, code_delta: str, confidence: float = 0.9):
     """
     Logs accepted code changes as learned patterns.
-    Capped at 100 entries (rolling window) to prevent memory bloat.
+    Appends one log line; low-retention patterns are evicted past CAG_MAX_PATTERNS.
     """
+    vector = self.embed(f"{user_intent}\n{signature}") if self.embed else None   # optional, outside the lock
     with MEMORY_LOCK:
-        self.learned.append({
-            "id": datetime.datetime.now().strftime("%H%M%S"),
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        now = datetime.datetime.now()
+        return self.store.add({
+            "id": uuid.uuid4().hex[:12],
+            "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
             "signature": signature,
             "user_intent": user_intent,
             "code_delta": code_delta[:2000],
             "confidence": confidence
-        })
-        save_learning_log(self.learned)  # persists last 100 only
+        }, vector)
 
 
-def get_relevant(self, query: str, k: int = 2) -> list:
+def get_relevant(self, query: str, k: int = 2, query_vec=None) -> list:
     """
-    Heuristic retrieval: scores patterns by intent match, signature match, and confidence.
+    Indexed retrieval: scores patterns by intent match, signature match, and confidence.
     Intent match weighted 2x over signature match — user goal matters more than symbol name.
     Returns top-k patterns sorted by composite score.
     """
-    q = query.lower()
-    scored = []
+    with MEMORY_LOCK:
+        return self.store.query(query, k, query_vec)
 
-    for entry in self.learned:
-        score = (
-            (2 if q in entry["user_intent"].lower() else 0) +  # intent match: weight 2
-            (1 if q in entry["signature"].lower() else 0)       # signature match: weight 1
-        )
-        if score > 0:
-            scored.append((score * entry.get("confidence", 0.5), entry))
 
-    scored.sort(reverse=True, key=lambda x: x[0])
-    return [entry for _, entry in scored[:k]]
+# CAGMemory.__init__:
+#
+#   self.store = PatternStore.load()             # replays learning_log.jsonl (imports the old .json once)
+#   self.embed = rag_engine._get_embedding if CAG_USE_EMBEDDINGS else None
+#
+# Callers that embed the request once for RAG can reuse it:
+#
+#   patterns = cag_memory.get_relevant(user_input, k=2, query_vec=query_vec)
@@ -0,0 +1,205 @@
+# Demonstrates: Incremental codebase re-indexing driven by a hash manifest.
+# Refreshing the vault used to re-chunk and re-embed every file. A manifest in
+# .vibe_index/ records each file's content hash and the hashes of the chunks
+# it produced; a re-index parses only files whose bytes changed, embeds only
+# functions/classes whose text changed, and drops stale rows from
+# rag_index.npy and rag_metadata.json without touching the rest.
+# Cheap enough to run on every save.
+# Part of RAGEngine in my_coder.py. Not standalone.
+
+RAG_METADATA_FILE = VIBE_INDEX_DIR / "rag_metadata.json"
+INDEX_MANIFEST_FILE = VIBE_INDEX_DIR / "index_manifest.json"
+INDEX_MANIFEST_VERSION = 2             # v2: per-file symbol refs/calls for the SymbolIndex
+RAG_EMBED_MODEL = "nomic-embed-text"   # vectors from another model are never reused
+
+INDEX_LOCK = threading.Lock()          # one re-index at a time; queries keep the old view until the swap
+
+
+def chunk_hash(text: str) -> str:
+    """
+    Identity of a chunk's embedding input — its text, nothing else.
+    Line numbers and importance are metadata: moving a function down the
+    file or gaining a caller elsewhere does not change its vector.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_write_json(path: Path, data):
+    tmp = Path(path).with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+def _load_manifest(self) -> dict:
+    """
+    The manifest, or an empty one when it is missing, from an older
+    format, or was written for a different embedding model.
+    """
+    manifest = {"version": INDEX_MANIFEST_VERSION, "model": RAG_EMBED_MODEL, "files": {}}
+    try:
+        stored = json.loads(INDEX_MANIFEST_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return manifest
+    if stored.get("version") == INDEX_MANIFEST_VERSION and stored.get("model") == RAG_EMBED_MODEL:
+        return stored
+    manifest["model_changed"] = stored.get("model") != RAG_EMBED_MODEL
+    return manifest
+
+
+def reindex(self, paths: list) -> dict:
+    """
+    Brings the vault in sync with the given files and returns counters.
+    Pass every project file for a full sync, or just the saved file on save;
+    a path that no longer exists has its chunks removed.
+
+    Per file:
+    1. size + mtime match the manifest  → skipped, not even read
+    2. sha256 of the bytes matches      → skipped, mtime refreshed
+    3. otherwise re-chunked; each chunk whose text hash matches one of
+       the file's existing rows keeps that row's vector, the rest are
+       embedded — in one batched call across all changed files. Rows the
+       new chunk list no longer contains are dropped.
+
+    Changed files are parsed and tokenized by index_sources (a process
+    pool for a full sync); their symbol scans update the symbol index, and
+    every row's importance is re-scored from the repo-wide counts.
+
+    Rows from a vault written before the manifest existed are matched by
+    hashing their stored text, so the first incremental run re-embeds
+    nothing that did not change.
+
+    If embedding fails, every changed file keeps its old rows and manifest
+    entry and is retried on the next run. The manifest is written last:
+    a crash mid-way repeats work, it never skips it.
+
+    The new metadata, index and symbols are built in locals and assigned to
+    self together at the end; a query running meanwhile keeps reading the
+    old view, whose entries are never mutated.
+
+    Past RAG_ANN_MIN_CHUNKS every re-index that changes rows also rebuilds
+    the HNSW index from scratch (see RetrievalIndex.save), which takes far
+    longer than the embed itself. At that size, batch saves into periodic
+    re-indexes instead of running on every save.
+    """
+    with INDEX_LOCK:
+        manifest = self._load_manifest()
+        model_changed = manifest.pop("model_changed", False)
+        old_vectors = self.retrieval_index.vectors if self.retrieval_index is not None else None
+        metadata = self.metadata
+
+        # Vectors from another model, or vectors and metadata out of step (interrupted write): start over
+        if model_changed or old_vectors is None or len(old_vectors) != len(metadata):
+            old_vectors, metadata, manifest["files"] = None, [], {}
+        files = manifest["files"]
+        symbols = SymbolIndex.from_manifest(files)
+
+        rows_by_file = {}
+        for row, entry in enumerate(metadata):
+            rows_by_file.setdefault(entry.get("file"), []).append(row)
+
+        stats = {"files_skipped": 0, "files_changed": 0, "files_removed": 0, "files_failed": 0,
+                 "chunks_reused": 0, "chunks_embedded": 0, "chunks_removed": 0}
+        drop, new_meta, new_vecs, to_parse = set(), [], [], []
+
+        for path in sorted({str(Path(p)) for p in paths}):
+            p = Path(path)
+            if not p.exists():
+                if path in files or path in rows_by_file:
+                    files.pop(path, None)
+                    symbols.remove(path)
+                    drop.update(rows_by_file.get(path, ()))
+                    stats["files_removed"] += 1
+                    stats["chunks_removed"] += len(rows_by_file.get(path, ()))
+                continue
+
+            st = p.stat()
+            known = files.get(path)
+            if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+                stats["files_skipped"] += 1
+                continue
+            data = p.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            if known and known["sha256"] == digest:
+                known["mtime_ns"] = st.st_mtime_ns
+                stats["files_skipped"] += 1
+                continue
+
+            to_parse.append((path, digest, st, data.decode("utf-8", errors="replace")))
+
+        # Parse + tokenize changed files (process pool for a full sync), then fold
+        # their symbol scans into the repo-wide index before anything is scored
+        parsed = index_sources([(path, code) for path, _, _, code in to_parse])
+        for result in parsed:
+            symbols.update(result["path"], result["refs"], result["calls"])
+
+        pending = []
+        for (path, digest, st, code), result in zip(to_parse, parsed):
+            old_rows = {metadata[r].get("chunk_hash") or chunk_hash(metadata[r].get("text", "")): r
+                        for r in rows_by_file.get(path, ())}
+            chunks = [chunk | {"file": path, "chunk_hash": chunk_hash(chunk["text"])}
+                      for chunk in self._finish_chunks(result["chunks"], code, symbols)]
+            pending.append((path, digest, st, old_rows, chunks, result))
+
+        # Every new chunk across every changed file goes out in one batched embed call
+        to_embed = {c["chunk_hash"]: c["text"] for _, _, _, old_rows, chunks, _ in pending
+                    for c in chunks if c["chunk_hash"] not in old_rows}
+        embedded = self._get_embeddings(list(to_embed.values())) if to_embed else np.empty((0, 0))
+        if embedded is None:
+            stats["files_failed"] += len(pending)
+            pending = []
+            symbols = SymbolIndex.from_manifest(files)   # back to what the manifest records
+        embedded = dict(zip(to_embed, embedded if embedded is not None else ()))
+
+        for path, digest, st, old_rows, chunks, result in pending:
+            reused = sum(c["chunk_hash"] in old_rows for c in chunks)
+            drop.update(rows_by_file.get(path, ()))
+            new_meta.extend(chunks)
+            new_vecs.extend(np.asarray(old_vectors[old_rows[c["chunk_hash"]]], dtype=np.float32)
+                            if c["chunk_hash"] in old_rows else embedded[c["chunk_hash"]] for c in chunks)
+            files[path] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                           "chunks": [c["chunk_hash"] for c in chunks],
+                           "refs": result["refs"], "calls": result["calls"]}
+            stats["files_changed"] += 1
+            stats["chunks_reused"] += reused
+            stats["chunks_embedded"] += len(chunks) - reused
+            stats["chunks_removed"] += len(rows_by_file.get(path, ())) - reused
+
+        if drop or new_meta or metadata is not self.metadata:
+            keep = [row for row in range(len(metadata)) if row not in drop]
+            parts = [np.asarray(old_vectors[keep], dtype=np.float32)] if keep else []
+            parts += [np.stack(new_vecs)] if new_vecs else []
+            # Copies: kept entries are re-scored below while queries still read the originals
+            new_metadata = [dict(metadata[row]) for row in keep] + new_meta
+
+            # Reference counts are repo-wide: an edit in one file can re-rank chunks in others
+            for entry in new_metadata:
+                if "line_count" in entry:
+                    entry["importance"] = chunk_importance(entry, symbols.ref_count(entry["name"]))
+
+            if new_metadata:
+                RetrievalIndex.save(np.concatenate(parts), new_metadata)
+            else:
+                for stale in (RAG_INDEX_FILE, RAG_IMPORTANCE_FILE, RAG_ANN_FILE):
+                    stale.unlink(missing_ok=True)
+            _atomic_write_json(RAG_METADATA_FILE, new_metadata)
+            retrieval_index = RetrievalIndex.load(new_metadata) if new_metadata else None
+
+            # The swap: nothing on self changed until the new view was complete
+            self.metadata, self.retrieval_index, self.vectors = (
+                new_metadata, retrieval_index,
+                retrieval_index.vectors if retrieval_index is not None else None)
+        self.symbols = symbols
+
+        _atomic_write_json(INDEX_MANIFEST_FILE, manifest)   # last — see docstring
+        return stats
+
+
+# On file save (editor hook / watcher):
+#
+#   stats = rag_engine.reindex([saved_path])
+#
+# Full sync at startup:
+#
+#   on_disk = {str(p) for p in Path(project_root).rglob("*.py") if VIBE_INDEX_DIR.name not in p.parts}
+#   known = set(rag_engine._load_manifest()["files"])   # so deleted files are noticed
+#   stats = rag_engine.reindex(sorted(on_disk | known))
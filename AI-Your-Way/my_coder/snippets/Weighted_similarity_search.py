@@ -1,38 +1,176 @@
 # Demonstrates: Importance-weighted cosine similarity for RAG retrieval.
 # Blends semantic similarity (70%) with chunk importance score (30%) to surface
 # well-documented, frequently-referenced code over obscure utilities.
+# Vectors are stored pre-normalized and memory-mapped, importance is a packed
+# array, and top-k uses partial selection — per-query work is one mat-vec.
+# Large vaults switch to an HNSW index automatically.
 # Part of RAGEngine in my_coder.py. Not standalone.
 
+VIBE_INDEX_DIR = Path(".vibe_index")
+RAG_INDEX_FILE = VIBE_INDEX_DIR / "rag_index.npy"             # unit-norm float32 vectors
+RAG_IMPORTANCE_FILE = VIBE_INDEX_DIR / "rag_importance.npy"   # packed importance, same row order
+RAG_ANN_FILE = VIBE_INDEX_DIR / "rag_ann.faiss"
+
+RAG_ANN_MIN_CHUNKS = 50_000   # exact search below this; HNSW above (if faiss is installed)
+RAG_ANN_OVERSAMPLE = 8        # ANN candidates per requested result, re-weighted exactly
+RAG_ANN_EF_SEARCH = 256       # HNSW search breadth — higher trades latency for recall
+
+
+def _atomic_save_npy(path: Path, array: np.ndarray):
+    """Writes beside the target and renames — a reader never maps a half-written file."""
+    tmp = Path(path).with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class RetrievalIndex:
+    """
+    Read-only view over the vault, built for the query hot path.
+
+    vectors  — (N, d) unit-norm float32, memory-mapped from rag_index.npy
+    weights  — (N,) float32, 0.7 + 0.3 * importance, precomputed
+    ann      — optional faiss HNSW over vectors (inner product == cosine)
+
+    Nothing here is recomputed per query: no norms, no normalized copy,
+    no importance list comprehension.
+    """
+
+    def __init__(self, vectors: np.ndarray, importance: np.ndarray, ann=None):
+        self.vectors = vectors
+        self.weights = (0.7 + 0.3 * importance).astype(np.float32)
+        self.ann = ann
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    @staticmethod
+    def save(vectors: np.ndarray, metadata: list, index_dir: Path = VIBE_INDEX_DIR):
+        """
+        Writes normalized vectors and the packed importance array.
+        Cosine similarity ignores magnitude, so storing unit vectors loses nothing.
+
+        The cached HNSW index is deleted, not patched: HNSW cannot remove
+        rows, and re-indexing drops and reorders them. Above
+        RAG_ANN_MIN_CHUNKS the next load() therefore rebuilds it from every
+        vector — minutes at a few hundred thousand chunks.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        _atomic_save_npy(Path(index_dir) / RAG_INDEX_FILE.name,
+                         vectors / np.where(norms == 0, 1e-12, norms))
+        _atomic_save_npy(Path(index_dir) / RAG_IMPORTANCE_FILE.name,
+                         np.array([m.get("importance", 0.5) for m in metadata], dtype=np.float32))
+        (Path(index_dir) / RAG_ANN_FILE.name).unlink(missing_ok=True)   # stale once vectors change
+
+    @classmethod
+    def load(cls, metadata: list, index_dir: Path = VIBE_INDEX_DIR):
+        """
+        Memory-maps the vault. A legacy rag_index.npy (raw, unnormalized
+        vectors) or a missing/short importance file is migrated once by
+        save() and then mapped like any other.
+        """
+        index_dir = Path(index_dir)
+        vectors_path = index_dir / RAG_INDEX_FILE.name
+        importance_path = index_dir / RAG_IMPORTANCE_FILE.name
+        if not vectors_path.exists():
+            return None
+
+        vectors = np.load(vectors_path, mmap_mode="r")
+        sample = np.linalg.norm(vectors[:min(len(vectors), 64)], axis=1)
+        stale = (not importance_path.exists()
+                 or len(np.load(importance_path, mmap_mode="r")) != len(vectors)
+                 or not np.allclose(sample[sample > 0], 1.0, atol=1e-3))
+        if stale:
+            cls.save(np.array(vectors), metadata, index_dir)
+            vectors = np.load(vectors_path, mmap_mode="r")
+
+        importance = np.load(importance_path)
+        return cls(vectors, importance, ann=cls._load_ann(vectors, index_dir))
+
+    @staticmethod
+    def _load_ann(vectors: np.ndarray, index_dir: Path):
+        """
+        HNSW over the unit vectors once the vault passes RAG_ANN_MIN_CHUNKS.
+        Cached in rag_ann.faiss and rebuilt when its size no longer matches.
+        faiss is optional — without it every vault uses exact search.
+        """
+        if len(vectors) < RAG_ANN_MIN_CHUNKS:
+            return None
+        try:
+            import faiss
+        except ImportError:
+            return None
+
+        ann_path = Path(index_dir) / RAG_ANN_FILE.name
+        ann = faiss.read_index(str(ann_path)) if ann_path.exists() else None
+        if ann is None or ann.ntotal != len(vectors):
+            ann = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+            ann.add(np.ascontiguousarray(vectors, dtype=np.float32))
+            faiss.write_index(ann, str(ann_path))
+        ann.hnsw.efSearch = RAG_ANN_EF_SEARCH
+        return ann
+
+    def search(self, query_vec: np.ndarray, k: int) -> tuple:
+        """
+        Returns (indices, sims, weighted) for the top-k by weighted score,
+        best first; ties break by lower index so results are stable.
+
+        Exact path: one mat-vec over the mapped vectors, argpartition for
+        the top k, then a sort of just those k.
+        ANN path: the HNSW index proposes k × RAG_ANN_OVERSAMPLE candidates
+        by cosine, and the same importance weighting picks the final k
+        from them.
+        """
+        q = np.asarray(query_vec, dtype=np.float32).ravel()
+        q = q / (np.linalg.norm(q) + 1e-12)
+        k = min(k, len(self))
+
+        if self.ann is not None:
+            _, ids = self.ann.search(q.reshape(1, -1), min(len(self), k * RAG_ANN_OVERSAMPLE))
+            candidates = ids[0][ids[0] >= 0]
+            sims = self.vectors[candidates] @ q
+        else:
+            candidates = None
+            sims = self.vectors @ q
+
+        weighted = sims * (self.weights if candidates is None else self.weights[candidates])
+        k = min(k, len(weighted))
+        top = np.argpartition(-weighted, k - 1)[:k] if k < len(weighted) else np.arange(len(weighted))
+        rows = top if candidates is None else candidates[top]
+        order = np.lexsort((rows, -weighted[top]))
+        top, rows = top[order], rows[order]
+        return rows, sims[top], weighted[top]
+
+
 def query(self, text: str, k: int = 3) -> list:
     """
     Retrieves k most relevant chunks using weighted similarity.
-    Score = 0.7 * cosine_similarity + 0.3 * importance_weight
+    Score = cosine_similarity * (0.7 + 0.3 * importance_weight)
     """
-    if self.vectors is None or len(self.metadata) == 0:
+    if self.retrieval_index is None or len(self.metadata) == 0:
         return []
 
     query_vec = self._get_embedding(text)
     if query_vec is None:
         return []
 
-    # Cosine similarity across all indexed chunks
-    query_norm = query_vec / (np.linalg.norm(query_vec) + 1e-12)
-    norms = np.linalg.norm(self.vectors, axis=1, keepdims=True)
-    vecs_norm = self.vectors / np.where(norms == 0, 1e-12, norms)
-    sims = np.dot(vecs_norm, query_norm)
-
     # Blend similarity with importance — prevents low-quality chunks from ranking high
-    importance_weights = np.array([m.get("importance", 0.5) for m in self.metadata])
-    weighted_sims = sims * (0.7 + 0.3 * importance_weights)
-
-    top_k_indices = np.argsort(weighted_sims)[::-1][:k]
+    top_k_indices, sims, weighted_sims = self.retrieval_index.search(query_vec, k)
 
     results = []
-    for idx in top_k_indices:
-        if weighted_sims[idx] > RAG_SIMILARITY_THRESHOLD and idx < len(self.metadata):
+    for idx, sim, weighted in zip(top_k_indices, sims, weighted_sims):
+        if weighted > RAG_SIMILARITY_THRESHOLD and idx < len(self.metadata):
             chunk = self.metadata[idx].copy()
-            chunk["similarity"] = float(sims[idx])
-            chunk["weighted_score"] = float(weighted_sims[idx])
+            chunk["similarity"] = float(sim)
+            chunk["weighted_score"] = float(weighted)
             results.append(chunk)
 
     return results
+
+
+# RAGEngine startup / after re-indexing:
+#
+#   RetrievalIndex.save(vectors, self.metadata)               # after new chunks are embedded
+#   self.retrieval_index = RetrievalIndex.load(self.metadata)
+#   self.vectors = self.retrieval_index.vectors if self.retrieval_index else None